@@ -1,12 +1,33 @@
 from django.conf.urls.defaults import *
 from django.contrib import admin
 from django.contrib.admin.util import unquote
-from django.http import HttpResponseRedirect
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse, HttpResponseRedirect, Http404
 from django.utils.translation import ugettext_lazy as _
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
 import django.forms
 import django.db.models
+import export
 import models
 import views
+from utils import StreamingHttpResponse
+
+
+def get_creation_choices():
+    """
+    Get choices for the *Add content* drop down in the admin.
+    """
+    # TODO:  Use url reversal rather than hard-wiring URL
+    choices = [('', '------')]
+    for question_type in models.QUESTION_TYPES:
+        app_label = question_type['class']._meta.app_label
+        c = ('/admin/%s/%s/add/' % (app_label, question_type['slug']),
+                question_type['pretty_name'])
+        choices.append(c)
+    return choices
 
 
 class ContentCreationForm(django.forms.Form):
@@ -15,8 +36,11 @@ class ContentCreationForm(django.forms.Form):
     Filters over models in SURVEY_CONTENT_CHOICE_LIST and uses the display
     format defined therein.
     """
-    choices = models.CHOICES
-    new_content_type = django.forms.ChoiceField(choices=choices)
+    new_content_type = django.forms.ChoiceField()
+
+    def __init__(self, *args, **kwds):
+        super(ContentCreationForm, self).__init__(*args, **kwds)
+        self.fields['new_content_type'].choices = get_creation_choices()
 
 
 class DynamicFormAdminForm(django.forms.ModelForm):
@@ -35,13 +59,14 @@ class DynamicFormAdmin(admin.ModelAdmin):
     """
     form = DynamicFormAdminForm
     change_form_template = "admin/change_dynamicform.html"
+    actions = ['copy_selected']
     add_form_template = "admin/add_dynamicform.html"
 
     def change_view(self, request, object_id, extra_context=None,
             *args, **kwds):
         request.session['last_dynamicform_id'] = object_id
         parent = self.get_object(request, unquote(object_id))
-        children = parent.questions.all()
+        children = parent.questions.all().resolve()
         # Handle the case where someone re-orders the list of content.
         order = [int(x) for x in request.GET.getlist('contentorder[]')]
         if order:
@@ -49,11 +74,7 @@ class DynamicFormAdmin(admin.ModelAdmin):
             # the request
             if views.list_contents_match(order, \
                     [child.pk for child in children]):
-                new_assignment = dict(
-                    [(order[i], i) for i in range(len(order))])
-                for child in children:
-                    child.order = 1 + new_assignment[child.pk]
-                    child.save()
+                parent.reorder_questions(order)
             # Handle different save buttons being clicked
             if request.POST.get('_continue') is not None:
                 return HttpResponseRedirect(parent.admin_url())
@@ -65,16 +86,10 @@ class DynamicFormAdmin(admin.ModelAdmin):
         # Delete selected objects.
         if request.method == 'POST' and \
             request.POST.get('action', None) == 'delete_selected':
-            # children as a dict indexed by pk.  That makes sure we only
-            # deleted children of current dynamicform
-            children = dict([(child.pk, child) for child in children])
+            # delete_questions makes sure we only delete children of the
+            # current dynamicform
             lst = [int(x) for x in request.POST.getlist('_selected_action')]
-            n = 0
-            for pk in lst:
-                child = children.get(pk, None)
-                if child:
-                    children[pk].delete()
-                    n += 1
+            n = parent.delete_questions(lst)
             from django.utils.translation import ngettext
             self.message_user(request, _("Successfully deleted %d %s.") %
                     (n, ngettext("item", "items", n)))
@@ -85,10 +100,99 @@ class DynamicFormAdmin(admin.ModelAdmin):
         return super(DynamicFormAdmin, self).change_view(request, object_id,
                 extra_context=context, *args, **kwds)
 
-    def _actions_column(self, dynamicform):
-        a = '<a title="Preview" href="%s" target="_blank"><img alt="Preview" src="/media/img/preview.gif" /></a>&nbsp;' % dynamicform.admin_url('preview')
-        b = '<a title="Copy" href="%s"><img alt="Copy" src="/media/img/copy.png" /></a>&nbsp;' % dynamicform.admin_url('copy')
-        return [a, b] + super(DynamicFormAdmin, self)._actions_column(dynamicform)
+    def get_urls(self):
+        urls = super(DynamicFormAdmin, self).get_urls()
+        extra_urls = patterns('',
+            url(r'^(.+)/export/(%s)/$' % '|'.join(export.FORMATS),
+                self.admin_site.admin_view(self.export_view),
+                name='dynamicforms_dynamicform_export'),
+            url(r'^(.+)/reorder/$',
+                self.admin_site.admin_view(self.reorder_view),
+                name='dynamicforms_dynamicform_reorder'),
+            url(r'^(.+)/publish/$',
+                self.admin_site.admin_view(self.publish_view),
+                name='dynamicforms_dynamicform_publish'),
+            url(r'^(.+)/copy/$',
+                self.admin_site.admin_view(self.copy_view),
+                name='dynamicforms_dynamicform_copy'),
+        )
+        return extra_urls + urls
+
+    def reorder_view(self, request, object_id):
+        """
+        Save a new question order posted as ``contentorder[]`` by the
+        sortable list, and answer with JSON.
+        """
+        dynamicform = self.get_object(request, unquote(object_id))
+        if dynamicform is None:
+            raise Http404
+        if not self.has_change_permission(request, dynamicform):
+            raise PermissionDenied
+        if request.method != 'POST':
+            return self._json_response({'error': 'POST required'}, 405)
+        try:
+            order = [int(x) for x in request.POST.getlist('contentorder[]')]
+            dynamicform.reorder_questions(order)
+        except ValueError, e:
+            return self._json_response({'error': str(e)}, 400)
+        return self._json_response({'order': order})
+
+    def publish_view(self, request, object_id):
+        """
+        Publish the current questions of a form as a new version.
+        """
+        dynamicform = self.get_object(request, unquote(object_id))
+        if dynamicform is None:
+            raise Http404
+        if not self.has_change_permission(request, dynamicform):
+            raise PermissionDenied
+        if request.method != 'POST':
+            return HttpResponseRedirect('../')
+        version = dynamicform.publish()
+        self.message_user(request, _("Published version %d of the form.") %
+            version.number)
+        return HttpResponseRedirect('../')
+
+    def copy_view(self, request, object_id):
+        """
+        Copy a form with its questions and choices, and show the copy.
+        """
+        dynamicform = self.get_object(request, unquote(object_id))
+        if dynamicform is None:
+            raise Http404
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+        if request.method != 'POST':
+            return HttpResponseRedirect('../')
+        copy = dynamicform.clone(_("Copy of %s") % dynamicform.name)
+        self.message_user(request, _("The form was copied."))
+        return HttpResponseRedirect(copy.admin_url())
+
+    def copy_selected(self, request, queryset):
+        for dynamicform in queryset:
+            dynamicform.clone(_("Copy of %s") % dynamicform.name)
+        self.message_user(request, _("Copied %d forms.") % len(queryset))
+    copy_selected.short_description = _("Copy selected forms")
+
+    def _json_response(self, data, status=200):
+        return HttpResponse(json.dumps(data), status=status,
+            content_type='application/json')
+
+    def export_view(self, request, object_id, format):
+        """
+        Stream all the responses to a form as CSV or JSON lines.
+        """
+        dynamicform = self.get_object(request, unquote(object_id))
+        if dynamicform is None:
+            raise Http404
+        if not self.has_change_permission(request, dynamicform):
+            raise PermissionDenied
+        response = StreamingHttpResponse(
+            export.iter_export(dynamicform, format),
+            content_type=export.FORMATS[format])
+        response['Content-Disposition'] = \
+            'attachment; filename=dynamicform-%d.%s' % (dynamicform.pk, format)
+        return response
 
 
 admin.site.register(models.DynamicForm, DynamicFormAdmin)
@@ -117,6 +221,26 @@ class DynamicFormQuestionAdmin(admin.ModelAdmin):
         return views.redirect_to_last_dynamicform(request)
 
 
+def register_admin():
+    """
+    Register question types in Django admin
+    """
+    for t in models.QUESTION_TYPES:
+        class_ = t['class']
+        class admin_class(DynamicFormQuestionAdmin):
+            model = class_
+
+        if getattr(class_, 'choice_class', None):
+            inline_class = type('%sInline' % class_.choice_class.__name__,
+                    (admin.StackedInline,), {'model': class_.choice_class})
+            admin_class.inlines = [inline_class]
+
+        admin.site.register(class_, admin_class)
+
+
+register_admin()
+
+
 ###############################################################################
 # Responses
 ###############################################################################
@@ -127,3 +251,7 @@ admin.site.register(models.DynamicMultipleChoiceAnswer)
 admin.site.register(models.DynamicResponseSet)
 admin.site.register(models.DynamicYesNoResponse)
 admin.site.register(models.DynamicRatingResponse)
+admin.site.register(models.DynamicSubmission)
+admin.site.register(models.ArchivedResponseSet)
+admin.site.register(models.LatestResponseSet)
+admin.site.register(models.DynamicFormVersion)
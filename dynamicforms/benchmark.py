@@ -0,0 +1,251 @@
+"""
+Benchmarks for the render, validate and submit paths.
+
+``run()`` generates a synthetic form with a configurable number of questions
+of each built-in type and measures wall time, query count and peak memory of
+the main code paths. ``compare()`` flags regressions against a baseline
+produced by an earlier run. Use the ``benchmark_dynamicforms`` management
+command to run them against a throwaway test database.
+"""
+import gc
+import os
+import pickle
+import resource
+import time
+import traceback
+
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test.client import RequestFactory
+
+import admin as dynamicforms_admin  # registers the admin classes
+import forms
+import schema
+from forms import DynamicFormCreator, DynamicFormShell
+from models import (DynamicForm, DynamicTextQuestion, DynamicYesNoQuestion,
+    DynamicMultipleChoiceQuestion, DynamicMultipleChoiceAnswer,
+    DynamicRatingQuestion, DynamicRatingAnswer, DynamicResponseSet,
+    bump_schema_version, iter_records)
+
+
+DEFAULT_COUNTS = {
+    'text': 20,
+    'yesno': 20,
+    'multiplechoice': 20,
+    'rating': 20,
+}
+
+METRICS = ('time', 'queries', 'memory')
+
+
+def create_form(counts=None, choices=5, name='Benchmark'):
+    """
+    Create a ``DynamicForm`` with ``counts[type]`` questions of each type and
+    ``choices`` answers per multiple choice and rating question. Return the
+    form and a POST dict answering every question.
+    """
+    counts = dict(DEFAULT_COUNTS, **(counts or {}))
+    df = DynamicForm.objects.create(name=name)
+    data = {}
+    order = 0
+    for i in range(counts['text']):
+        order += 1
+        q = DynamicTextQuestion.objects.create(parent_object=df, order=order,
+            question_text='Text question %d' % i)
+        data[q.get_form_name()] = 'Answer %d' % i
+    for i in range(counts['yesno']):
+        order += 1
+        q = DynamicYesNoQuestion.objects.create(parent_object=df, order=order,
+            question_text='Yes/No question %d' % i)
+        data[q.get_form_name()] = 'yes' if i % 2 else 'no'
+    for i in range(counts['multiplechoice']):
+        order += 1
+        q = DynamicMultipleChoiceQuestion.objects.create(parent_object=df,
+            order=order, question_text='Multiple choice question %d' % i)
+        answers = [DynamicMultipleChoiceAnswer.objects.create(question=q,
+            answer_text='Choice %d' % j) for j in range(choices)]
+        data[q.get_form_name()] = ['dynamic-multiple-choice-answer-%d' % a.pk
+            for a in answers[::2]]
+    for i in range(counts['rating']):
+        order += 1
+        q = DynamicRatingQuestion.objects.create(parent_object=df,
+            order=order, question_text='Rating question %d' % i)
+        answers = [DynamicRatingAnswer.objects.create(question=q,
+            answer_text='%d' % j) for j in range(choices)]
+        if answers:
+            data[q.get_form_name()] = 'dynamic-rating-answer-%d' % \
+                answers[-1].pk
+    return df, data
+
+
+def measure(func, repeat=5):
+    """
+    Call ``func`` ``repeat`` times and return the best wall time in seconds,
+    the query count of the last call and the growth of the peak resident
+    memory in kilobytes.
+
+    The calls run in a forked child process, whose peak memory starts from
+    the parent's current size, so the memory of one benchmark doesn't depend
+    on which ones ran before it. Except on SQLite, the child opens a
+    connection of its own, so the current transaction is committed first for
+    the child to see its data; the child's changes are seen by the parent
+    only in that case. Without ``os.fork`` the calls run in this process.
+    """
+    if not hasattr(os, 'fork'):
+        return _measure(func, repeat)
+    if connection.vendor != 'sqlite':
+        if transaction.is_managed():
+            transaction.commit()
+        else:
+            transaction.commit_unless_managed()
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(read)
+            if connection.vendor != 'sqlite':
+                # Don't share the parent's socket.
+                connection.connection = None
+            try:
+                data = pickle.dumps(_measure(func, repeat))
+            except Exception:
+                data = pickle.dumps({'error': traceback.format_exc()})
+            while data:
+                data = data[os.write(write, data):]
+        finally:
+            os._exit(0)
+    os.close(write)
+    f = os.fdopen(read, 'rb')
+    try:
+        data = f.read()
+    finally:
+        f.close()
+        os.waitpid(pid, 0)
+    if not data:
+        raise RuntimeError('The benchmark process died.')
+    result = pickle.loads(data)
+    if 'error' in result:
+        raise RuntimeError(result['error'])
+    return result
+
+
+def _measure(func, repeat):
+    best = None
+    queries = 0
+    old_debug_cursor = connection.use_debug_cursor
+    connection.use_debug_cursor = True
+    gc.collect()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        for i in range(repeat):
+            start_queries = len(connection.queries)
+            start = time.time()
+            func()
+            elapsed = time.time() - start
+            queries = len(connection.queries) - start_queries
+            if best is None or elapsed < best:
+                best = elapsed
+    finally:
+        connection.use_debug_cursor = old_debug_cursor
+    memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - peak
+    return {'time': best, 'queries': queries, 'memory': memory}
+
+
+def run(counts=None, choices=5, repeat=5):
+    """
+    Run every benchmark on a freshly generated form and return the results
+    as a dict of ``{benchmark: {metric: value}}``. Schema caching is turned
+    on for the run whatever ``DYNAMICFORMS_SCHEMA_CACHE`` says, so that
+    ``render`` and ``render_uncached`` differ.
+    """
+    df, data = create_form(counts, choices)
+    user = User.objects.create_user('dynamicforms-benchmark',
+        'benchmark@example.com', 'benchmark')
+    user.is_staff = user.is_superuser = True
+    user.save()
+    factory = RequestFactory()
+
+    def render():
+        request = factory.get('/')
+        request.user = user
+        unicode(DynamicFormCreator(request, df.pk).get())
+
+    def render_uncached():
+        bump_schema_version(df.pk)
+        render()
+
+    def validate():
+        form = DynamicFormShell.from_schema(schema.get_schema(df), data)
+        assert form.is_valid(), form.errors
+
+    def submit():
+        request = factory.post('/', data)
+        request.user = user
+        assert DynamicFormCreator(request, df.pk,
+            force_new_set=True).is_success()
+
+    submit()
+    response_set = DynamicResponseSet.objects.filter(dynamic_form=df)[0]
+
+    def responses():
+        for r in DynamicResponseSet.objects.get(pk=response_set.pk).responses:
+            unicode(r)
+
+    def records():
+        list(iter_records([response_set.pk]))
+
+    model_admin = admin.site._registry[DynamicForm]
+
+    def admin_change_view():
+        # Called directly: the test client would reset connection.queries.
+        request = factory.get('/')
+        request.user = user
+        request.session = {}
+        response = model_admin.change_view(request, str(df.pk))
+        assert response.status_code == 200, response.status_code
+        if hasattr(response, 'render'):
+            response.render()
+
+    benchmarks = (
+        ('render', render),
+        ('render_uncached', render_uncached),
+        ('validate', validate),
+        ('submit', submit),
+        ('responses', responses),
+        ('records', records),
+        ('admin_change_view', admin_change_view),
+    )
+    schema_cache, forms.SCHEMA_CACHE = forms.SCHEMA_CACHE, True
+    try:
+        return dict([(name, measure(func, repeat))
+            for name, func in benchmarks])
+    finally:
+        forms.SCHEMA_CACHE = schema_cache
+
+
+def compare(results, baseline, threshold=0.2):
+    """
+    Return a list of ``(benchmark, metric, baseline, result)`` for every
+    metric that grew by more than ``threshold`` (a fraction) over
+    ``baseline``. Query counts are flagged on any increase.
+    """
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        for metric in METRICS:
+            old = baseline[name].get(metric)
+            new = results[name].get(metric)
+            if old is None or new is None:
+                continue
+            if metric == 'queries':
+                regressed = new > old
+            elif metric == 'memory':
+                # ru_maxrss is coarse; ignore growth under a megabyte.
+                regressed = new > old * (1 + threshold) and new - old > 1024
+            else:
+                regressed = new > old * (1 + threshold)
+            if regressed:
+                regressions.append((name, metric, old, new))
+    return regressions
@@ -0,0 +1,127 @@
+"""
+Streaming export of all the responses to a form.
+
+Response sets are walked in keyset-paginated chunks ordered by id, and the
+responses of each chunk are read with ``models.iter_records``, so memory
+use doesn't depend on the size of the form's history. Every response set
+becomes one row with a column per question, in question order. Archived
+response sets are included, in id order with the live ones.
+"""
+import csv
+import heapq
+from cStringIO import StringIO
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+import models
+
+
+CHUNK_SIZE = 500
+
+FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+
+def get_columns(dynamicform):
+    """
+    Return a list of ``(question_id, question_text)`` in question order,
+    leaving out page breaks.
+    """
+    page_break = models.QUESTION_TYPES.get_content_type(
+        models.DynamicPageBreak)
+    return list(dynamicform.questions.exclude(real_type=page_break)
+        .values_list('pk', 'question_text'))
+
+
+def iter_response_sets(dynamicform, chunk_size=CHUNK_SIZE, archived=True):
+    """
+    Yield ``(response_set, values)`` for every response set of
+    ``dynamicform``, where ``values`` maps question ids to the rendered
+    responses. Several responses to the same question are joined with
+    ``'; '``. ``response_set`` is an ``ArchivedResponseSet`` for archived
+    sets, unless ``archived`` is false.
+    """
+    streams = [_iter_values(models.DynamicResponseSet, dynamicform,
+        chunk_size)]
+    if archived:
+        streams.append(_iter_values(models.ArchivedResponseSet, dynamicform,
+            chunk_size))
+    for pk, response_set, values in heapq.merge(*streams):
+        yield response_set, values
+
+
+def _iter_values(model, dynamicform, chunk_size):
+    last_pk = 0
+    while True:
+        chunk = list(model.objects.filter(
+            dynamic_form=dynamicform, pk__gt=last_pk).select_related(
+            'user', 'interviewer').order_by('pk')[:chunk_size])
+        if not chunk:
+            return
+        records = models.get_records(chunk)
+        for response_set in chunk:
+            values = {}
+            for record in records[response_set.pk]:
+                if record.question_id in values:
+                    values[record.question_id] += u'; ' + record.value
+                else:
+                    values[record.question_id] = record.value
+            yield response_set.pk, response_set, values
+        last_pk = chunk[-1].pk
+
+
+def _username(user):
+    return user.username if user is not None else u''
+
+
+def iter_csv(dynamicform, chunk_size=CHUNK_SIZE):
+    """
+    Yield the export of ``dynamicform`` as UTF-8 encoded CSV lines, header
+    first.
+    """
+    columns = get_columns(dynamicform)
+    buf = StringIO()
+    writer = csv.writer(buf)
+
+    def line(row):
+        writer.writerow([unicode(v).encode('utf-8') for v in row])
+        value = buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+        return value
+
+    yield line(['response_set', 'user', 'interviewer', 'added'] +
+        [text for pk, text in columns])
+    for response_set, values in iter_response_sets(dynamicform, chunk_size):
+        yield line([response_set.pk, _username(response_set.user),
+            _username(response_set.interviewer),
+            response_set.added.isoformat()] +
+            [values.get(pk, u'') for pk, text in columns])
+
+
+def iter_jsonl(dynamicform, chunk_size=CHUNK_SIZE):
+    """
+    Yield the export of ``dynamicform`` as JSON lines, one object per
+    response set with its responses keyed by question id.
+    """
+    for response_set, values in iter_response_sets(dynamicform, chunk_size):
+        yield json.dumps({
+            'response_set': response_set.pk,
+            'user': _username(response_set.user),
+            'interviewer': _username(response_set.interviewer),
+            'added': response_set.added.isoformat(),
+            'responses': dict([(str(k), v) for k, v in values.items()]),
+        }) + '\n'
+
+
+def iter_export(dynamicform, format='csv', chunk_size=CHUNK_SIZE):
+    if format == 'csv':
+        return iter_csv(dynamicform, chunk_size)
+    if format == 'jsonl':
+        return iter_jsonl(dynamicform, chunk_size)
+    raise ValueError("Unknown export format '%s'." % format)
@@ -1,14 +1,20 @@
 from re import compile
 from django import forms
-from django.http import HttpResponseRedirect
+from django.conf import settings
+from django.http import HttpResponseRedirect, Http404
 from django.shortcuts import get_object_or_404
+from django.utils.safestring import mark_safe
+from django.utils.translation import get_language
 import models
+import outbox
+import schema
+from signals import answers_dropped, measure_phase
+from utils import atomic
 
 
-TYPES_HASH = {}
+SCHEMA_CACHE = getattr(settings, 'DYNAMICFORMS_SCHEMA_CACHE', False)
 
-for t in models.QUESTION_TYPES:
-    TYPES_HASH[t['slug']] = t
+QUEUE_SUBMISSIONS = getattr(settings, 'DYNAMICFORMS_QUEUE_SUBMISSIONS', False)
 
 
 class DynamicFormShell(forms.Form):
@@ -21,10 +27,53 @@ class DynamicFormShell(forms.Form):
     for more information on how this works
     """
 
+    CACHED_RENDERINGS = ('as_p', 'as_table', 'as_ul')
+
+    # ``(dynamicform_id, version)`` of the schema the form was built from
+    schema_version = None
+    # How long ``render_cached`` keeps the rendered form
+    cache_timeout = schema.SCHEMA_CACHE_TIMEOUT
+
     def __init__(self, *args, **kwds):
         kwds['label_suffix'] = ''
         return super(DynamicFormShell, self).__init__(*args, **kwds)
 
+    @classmethod
+    def from_schema(cls, form_schema, *args, **kwds):
+        """
+        Create a form with the fields described by a compiled schema. No
+        queries are needed. Pass ``schema_version`` to allow the rendered
+        form to be cached by ``render_cached``, for ``cache_timeout``
+        seconds.
+        """
+        schema_version = kwds.pop('schema_version', None)
+        cache_timeout = kwds.pop('cache_timeout', None)
+        form = cls(*args, **kwds)
+        for spec in form_schema:
+            if not spec.is_page_break:
+                form.add_field(spec.key, spec.build())
+        form.schema_version = schema_version
+        if cache_timeout is not None:
+            form.cache_timeout = cache_timeout
+        return form
+
+    def render_cached(self, method='as_p'):
+        """
+        Return the form rendered with ``method``. Unbound forms built from a
+        versioned schema are rendered once per schema version and then served
+        from the cache; anything else is rendered as usual.
+        """
+        if method not in self.CACHED_RENDERINGS:
+            raise ValueError("Can't cache the '%s' rendering." % method)
+        render = getattr(self, method)
+        if self.is_bound or self.initial or self.schema_version is None:
+            return render()
+        dynamicform_id, version = self.schema_version
+        variant = '%s:%s:%s:%s' % (method, self.prefix, self.auto_id,
+            get_language())
+        return mark_safe(schema.get_html(dynamicform_id, version, variant,
+            render, self.cache_timeout))
+
     def add_field(self, key, value):
         self.fields[key] = value
 
@@ -35,9 +84,12 @@ class DynamicFormShell(forms.Form):
 class DynamicFormCreator(object):
 
     PATTERN = compile(r'^([a-z-]+)-([0-9]+)$')
+    # Session key of the response set a paged form is being filled in.
+    SESSION_KEY = 'dynamicforms:response-set:%d:%s'
 
     def __init__(self, request, dynamicform_id, redirect=None, user=None,
-            force_new_set=False):
+            force_new_set=False, queue=None, draft=False, page=None,
+            page_size=None):
         """
         This is the heart of the DynamicForms app. This class creates an
         instance of DynamicFormShell and inserts into it the form fields
@@ -51,6 +103,15 @@ class DynamicFormCreator(object):
             `user`            - user override; use logged in user by default
             `force_new_set`   - each time a form is filled out, create new
                                  response set
+            `queue`           - only store valid submissions for
+                                 ``process_submissions`` to save later;
+                                 ``DYNAMICFORMS_QUEUE_SUBMISSIONS`` by default
+            `draft`           - use the current questions even if a version of
+                                 the form was published
+            `page`            - show, validate and save only this page of
+                                 the form, counting from 1
+            `page_size`       - also start a new page after every
+                                 ``page_size`` questions; implies paging
         """
 
         self.request = request
@@ -61,26 +122,123 @@ class DynamicFormCreator(object):
         self.dynamicform_id = dynamicform_id
         self.redirect = redirect
         self.force_new_set = force_new_set
+        self.queue = QUEUE_SUBMISSIONS if queue is None else queue
+        self.paged = page is not None or page_size is not None
+        self.page_size = page_size
+        try:
+            self.page = int(page or 1)
+        except ValueError:
+            raise Http404
+        self.page_count = 1
+        # Field names of the current page mapped to question ids
+        self.page_ids = {}
+        self._page_contents = None
 
-        self.dynamicform = get_object_or_404(models.DynamicForm,
+        self.dynamicform = get_object_or_404(
+                models.DynamicForm.objects.select_related('published'),
                 id=self.dynamicform_id)
+        self.version = None if draft else self.dynamicform.published
         self.form = DynamicFormShell()
-        self.contents = self.dynamicform.questions.all()
+        self._contents = None
 
         self.response_set = None
+        self.submission = None
         self.success = False
+        # Submitted values whose question or choices no longer exist
+        self.dropped = {}
 
-        self.populate_form()
+        with measure_phase(self, 'populate_form'):
+            self.populate_form()
 
         if self.request.POST:
             self.add_data(request.POST)
             self.save_data()
 
+    @property
+    def contents(self):
+        """
+        The resolved questions of the form, loaded on first access.
+        """
+        if self._contents is None:
+            self._contents = self.dynamicform.get_questions()
+        return self._contents
+
     def populate_form(self):
-        for item in self.contents:
-            item = item.resolve()
-            f, id = item.display(self.user)
-            self.form.add_field(id, f)
+        if self.paged:
+            return self._populate_page()
+        cache_timeout = None
+        if self.version is not None:
+            form_schema = self.version.get_schema()
+            version = 'v' + self.version.cache_key
+            cache_timeout = schema.VERSION_CACHE_TIMEOUT
+        elif SCHEMA_CACHE:
+            version, form_schema = schema.get_versioned_schema(
+                    self.dynamicform, lambda: self.contents)
+        else:
+            for item in self.contents:
+                f, id = item.display(self.user)
+                if f is not None:
+                    self.form.add_field(id, f)
+            return
+        self.form = DynamicFormShell.from_schema(form_schema,
+                schema_version=(self.dynamicform.pk, version),
+                cache_timeout=cache_timeout)
+
+    def _populate_page(self):
+        """
+        Build the fields of the current page only. Pages are cut from the
+        published snapshot, or from an ordered list of the ids and types of
+        the questions, so only the page's questions are ever resolved.
+        """
+        cache_timeout = None
+        if self.version is not None:
+            ids = [q['id'] for q in self.version.get_snapshot()]
+            page = self._get_page(zip(self.version.get_schema(), ids),
+                    lambda (spec, pk): spec.is_page_break)
+            form_schema = [spec for spec, pk in page]
+            self.page_ids = dict([(spec.key, pk) for spec, pk in page])
+            version = 'v' + self.version.cache_key
+            cache_timeout = schema.VERSION_CACHE_TIMEOUT
+        else:
+            page_break = models.QUESTION_TYPES.get_content_type(
+                    models.DynamicPageBreak).pk
+            page = self._get_page(
+                    self.dynamicform.questions.values_list('pk', 'real_type'),
+                    lambda (pk, real_type): real_type == page_break)
+            get_class = models.QUESTION_TYPES.get_class_for_content_type_id
+            self.page_ids = dict([('%s-%d' % (
+                get_class(real_type)._meta.module_name, pk), pk)
+                for pk, real_type in page])
+            if SCHEMA_CACHE:
+                version, form_schema = schema.get_versioned_schema(
+                        self.dynamicform)
+                form_schema = [spec for spec in form_schema
+                    if spec.key in self.page_ids]
+            else:
+                version = None
+                form_schema = schema.compile_schema(self._get_questions(),
+                        self.user)
+        if version is not None:
+            version = '%s:p%d:%d' % (version, self.page_size or 0, self.page)
+        self.form = DynamicFormShell.from_schema(form_schema,
+                schema_version=version and (self.dynamicform.pk, version),
+                cache_timeout=cache_timeout)
+
+    def _get_page(self, items, is_page_break):
+        pages = schema.split_pages(items, self.page_size, is_page_break)
+        self.page_count = len(pages)
+        if not 1 <= self.page <= self.page_count:
+            raise Http404
+        return pages[self.page - 1]
+
+    @property
+    def next_page(self):
+        """
+        The number of the page after this one, or ``None`` on the last page.
+        """
+        if self.page < self.page_count:
+            return self.page + 1
+        return None
 
     def get(self):
         return self.form
@@ -97,48 +255,125 @@ class DynamicFormCreator(object):
         """
         Check if the submitted form was valid and save the data
         """
-        if not self.form.is_valid():
+        with measure_phase(self, 'validate'):
+            valid = self.form.is_valid()
+        if not valid:
             return
+        with measure_phase(self, 'save_data'):
+            if self.queue and not self.paged:
+                self.submission = outbox.enqueue(self)
+            else:
+                self._save_data()
+                if self.paged and self.next_page is None:
+                    self._finish_pages()
+
+        self.success = True
+
+        return HttpResponseRedirect(self.redirect)
+
+    def _save_data(self):
         data = self.form.cleaned_data
+        questions = dict([(q.get_form_name(), q)
+            for q in self._get_questions()])
+
+        with atomic():
+            started = self._set_response_set()
+
+            responses = []
+            for d in data:
+                try:
+                    question = questions[d]
+                except KeyError:
+                    # Deleted since the form was built, or since the
+                    # version was published.
+                    self.dropped[d] = data[d]
+                    continue
+                rows = self._save_response(question, data[d])
+                if models.lost_choices(question, data[d], rows):
+                    self.dropped[d] = data[d]
+                responses.extend(rows)
+
+            models.save_responses(responses)
+            models.increment_tallies(self.dynamicform, responses)
+            if started:
+                models.record_submissions(self.user, self.dynamicform,
+                        self.response_set)
+        if self.dropped:
+            answers_dropped.send(sender=type(self),
+                dynamicform_id=self.dynamicform.pk,
+                form_version_id=self.version and self.version.pk,
+                response_set_id=self.response_set.pk, values=self.dropped)
+
+    def _get_questions(self):
+        """
+        Return the resolved questions to save answers to: all of them, or
+        only those of the current page in paged mode.
+        """
+        if not self.paged:
+            return self.contents
+        if self._page_contents is None:
+            self._page_contents = models.prefetch_choices(self.dynamicform
+                .questions.filter(pk__in=self.page_ids.values()).resolve())
+        return self._page_contents
 
+    def _set_response_set(self):
+        """
+        Set the response set to save to, and return whether this submission
+        starts a new one.
+
+        In paged mode, the first page keeps the id of its set in the
+        session, and the following pages go on with that set until the last
+        one is saved. Without a session, they use the shared set of the
+        user, form and interviewer, or a new one with ``force_new_set``.
+        """
+        session = getattr(self.request, 'session', None)
+        key = self.SESSION_KEY % (self.dynamicform.pk, self.user.pk)
+        if self.paged and self.page > 1 and session is not None and \
+                key in session:
+            try:
+                self.response_set = models.DynamicResponseSet.objects.get(
+                        pk=session[key], user=self.user,
+                        dynamic_form=self.dynamicform)
+                return False
+            except models.DynamicResponseSet.DoesNotExist:
+                pass
         if self.force_new_set:
             self.response_set = models.DynamicResponseSet.objects.create(
                     user=self.user,
                     dynamic_form=self.dynamicform,
-                    interviewer=self.request.user)
+                    interviewer=self.request.user,
+                    form_version=self.version)
+            created = True
         else:
-            self.response_set = \
-                models.DynamicResponseSet.objects.get_or_create(
-                    user=self.user,
-                    dynamic_form=self.dynamicform,
-                    interviewer=self.request.user)[0]
-
-        for d in data:
-            try:
-                meta = self.PATTERN.findall(d)[0]
-            except IndexError:
-                pass
-            response = self.form.cleaned_data[d]
-            self._save_response(meta, response)
+            self.response_set, created = \
+                models.DynamicResponseSet.objects.upsert(self.user,
+                    self.dynamicform, self.request.user, self.version)
+        if self.paged and session is not None:
+            session[key] = self.response_set.pk
+        return self.page == 1 or created
 
-        self.success = True
-
-        return HttpResponseRedirect(self.redirect)
+    def _finish_pages(self):
+        """
+        Forget the response set of a paged form once its last page is saved.
+        """
+        session = getattr(self.request, 'session', None)
+        if session is not None:
+            session.pop(self.SESSION_KEY % (self.dynamicform.pk,
+                self.user.pk), None)
 
     def is_success(self):
         return self.success
 
-    def _save_response(self, meta, response):
+    def is_finished(self):
         """
-        Insert the response to the database. This method ensures that no
-        prorperly validated responses get thrown away.
+        Whether the last page, or the whole form, was saved.
         """
-        question_type = meta[0]
-        question_id = meta[1]
-
-        try:
-            class_ = TYPES_HASH[question_type]['class']
-        except KeyError:
-            raise Exception("Can't find the '%s' type." % question_type)
+        return self.success and self.next_page is None
 
-        class_.save_response(self.user, question_id, response, self.response_set)
+    def _save_response(self, question, response):
+        """
+        Return the unsaved response rows for ``question``. This method ensures
+        that no prorperly validated responses get thrown away.
+        """
+        return question.build_responses(self.user, response,
+                self.response_set)
@@ -0,0 +1,95 @@
+"""
+Composite indexes for the lookups dynamicforms runs most.
+
+Django only creates single-column indexes, so the multi-column ones are
+listed here and created by ``create_indexes``, which runs after ``syncdb``
+and through the ``create_indexes`` management command for existing
+databases. Indexes that already exist are skipped.
+"""
+from django.db import connections, router, transaction, DEFAULT_DB_ALIAS
+from django.db.backends.util import truncate_name
+
+import models
+
+
+# ``(model, name, fields)``; the index is called ``<table>_<name>``.
+COMPOSITE_INDEXES = (
+    # A form's questions, in order.
+    (models.DynamicFormQuestion, 'parent',
+        ('content_type', 'object_id', 'order', 'id')),
+    # ``get_or_create`` of the response set of a user.
+    (models.DynamicResponseSet, 'owner',
+        ('user', 'dynamic_form', 'interviewer')),
+) + tuple([(model, 'set_question', ('dynamic_response_set', 'question'))
+    for model in models.RESPONSE_MODELS])
+
+
+def get_index_name(connection, model, name):
+    return truncate_name('%s_%s' % (model._meta.db_table, name),
+        connection.ops.max_name_length())
+
+
+def get_index_sql(connection, model, name, fields):
+    qn = connection.ops.quote_name
+    columns = [model._meta.get_field(f).column for f in fields]
+    return 'CREATE INDEX %s ON %s (%s)' % (
+        qn(get_index_name(connection, model, name)),
+        qn(model._meta.db_table), ', '.join([qn(c) for c in columns]))
+
+
+def get_existing_indexes(connection, table):
+    """
+    Return the lowercased names of the indexes of ``table``.
+    """
+    cursor = connection.cursor()
+    vendor = connection.vendor
+    if vendor == 'sqlite':
+        cursor.execute("SELECT name FROM sqlite_master "
+            "WHERE type = 'index' AND tbl_name = %s", [table])
+    elif vendor == 'postgresql':
+        cursor.execute("SELECT indexname FROM pg_indexes "
+            "WHERE tablename = %s", [table])
+    elif vendor == 'mysql':
+        cursor.execute('SHOW INDEX FROM %s' %
+            connection.ops.quote_name(table))
+        return set([row[2].lower() for row in cursor.fetchall()])
+    elif vendor == 'oracle':
+        cursor.execute('SELECT index_name FROM user_indexes '
+            'WHERE table_name = %s', [table.upper()])
+    else:
+        raise ValueError("Can't list the indexes of a %s database." % vendor)
+    return set([row[0].lower() for row in cursor.fetchall()])
+
+
+def get_missing_indexes(using=DEFAULT_DB_ALIAS):
+    """
+    Return the ``CREATE INDEX`` statements of the composite indexes missing
+    from database ``using``.
+    """
+    connection = connections[using]
+    tables = connection.introspection.table_names()
+    statements = []
+    for model, name, fields in COMPOSITE_INDEXES:
+        table = model._meta.db_table
+        if table not in tables or not router.allow_syncdb(using, model):
+            continue
+        if get_index_name(connection, model, name).lower() not in \
+                get_existing_indexes(connection, table):
+            statements.append(get_index_sql(connection, model, name, fields))
+    return statements
+
+
+def create_indexes(using=DEFAULT_DB_ALIAS, verbosity=1, stdout=None):
+    """
+    Create the missing composite indexes in database ``using`` and return
+    their number. With a ``verbosity`` of 2 or more, the statements are
+    written to the ``stdout`` stream, if one is given.
+    """
+    statements = get_missing_indexes(using)
+    cursor = connections[using].cursor()
+    for sql in statements:
+        if verbosity >= 2 and stdout is not None:
+            stdout.write(sql + ';\n')
+        cursor.execute(sql)
+    transaction.commit_unless_managed(using)
+    return len(statements)
@@ -0,0 +1,14 @@
+import sys
+
+from django.db.models.signals import post_syncdb
+
+from dynamicforms import indexes, models
+
+
+def create_indexes(sender, verbosity=1, db=None, **kwargs):
+    # syncdb reports its own progress on sys.stdout.
+    indexes.create_indexes(db, verbosity, sys.stdout)
+
+
+post_syncdb.connect(create_indexes, sender=models,
+    dispatch_uid='dynamicforms.management.create_indexes')
@@ -0,0 +1,62 @@
+import time
+from datetime import datetime, timedelta
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dynamicforms.models import (DynamicForm, DynamicResponseSet, CHUNK_SIZE,
+    archive_response_sets)
+from dynamicforms.utils import atomic
+
+
+class Command(BaseCommand):
+    args = '[<dynamicform_id> ...]'
+    help = ('Move the response sets of the given forms, or of all forms, '
+        'added before a cutoff to the archive.')
+    option_list = BaseCommand.option_list + (
+        make_option('--before', dest='before', default=None,
+            help='Archive response sets added before this date (YYYY-MM-DD).'),
+        make_option('--days', dest='days', type='int', default=None,
+            help='Archive response sets older than this many days.'),
+        make_option('--batch-size', dest='batch_size', type='int',
+            default=CHUNK_SIZE,
+            help='Number of response sets archived per transaction.'),
+        make_option('--sleep', dest='sleep', type='float', default=0,
+            help='Seconds to wait between batches.'),
+    )
+
+    def handle(self, *args, **options):
+        if options['before'] is not None:
+            try:
+                cutoff = datetime.strptime(options['before'], '%Y-%m-%d')
+            except ValueError:
+                raise CommandError("Invalid date '%s'." % options['before'])
+        elif options['days'] is not None:
+            cutoff = datetime.now() - timedelta(days=options['days'])
+        else:
+            raise CommandError('Give a cutoff with --before or --days.')
+        forms = []
+        for dynamicform_id in args:
+            try:
+                forms.append(DynamicForm.objects.get(pk=dynamicform_id))
+            except (DynamicForm.DoesNotExist, ValueError):
+                raise CommandError("Dynamic form '%s' does not exist." %
+                    dynamicform_id)
+
+        response_sets = DynamicResponseSet.objects.filter(added__lt=cutoff) \
+            .order_by('pk')
+        if forms:
+            response_sets = response_sets.filter(dynamic_form__in=forms)
+        last_pk = 0
+        n = 0
+        while True:
+            with atomic():
+                chunk = list(response_sets.filter(pk__gt=last_pk)
+                    [:options['batch_size']])
+                if not chunk:
+                    break
+                n += archive_response_sets(chunk)
+            last_pk = chunk[-1].pk
+            if options['sleep']:
+                time.sleep(options['sleep'])
+        self.stdout.write('Archived %d response sets.\n' % n)
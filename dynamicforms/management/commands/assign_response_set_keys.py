@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from dynamicforms.models import assign_unique_keys
+from dynamicforms.utils import atomic
+
+
+class Command(BaseCommand):
+    help = ('Mark the latest response set of every user, form and '
+        'interviewer as the one to reuse for new submissions.')
+
+    def handle(self, *args, **options):
+        with atomic():
+            n = assign_unique_keys()
+        self.stdout.write('Assigned %d keys.\n' % n)
@@ -0,0 +1,72 @@
+from optparse import make_option
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.simple import DjangoTestSuiteRunner
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from dynamicforms import benchmark
+
+
+class Command(BaseCommand):
+    help = ('Benchmark rendering, validating and submitting a generated '
+        'dynamic form on a test database.')
+    option_list = BaseCommand.option_list + tuple([
+        make_option('--%s' % t, dest=t, type='int',
+            default=benchmark.DEFAULT_COUNTS[t],
+            help='Number of %s questions.' % t)
+        for t in sorted(benchmark.DEFAULT_COUNTS)]) + (
+        make_option('--choices', dest='choices', type='int', default=5,
+            help='Number of answers per multiple choice and rating question.'),
+        make_option('--repeat', dest='repeat', type='int', default=5,
+            help='Number of runs per benchmark; the best time is kept.'),
+        make_option('--output', dest='output', default=None,
+            help='Write the results as JSON to this file.'),
+        make_option('--compare', dest='compare', default=None,
+            help='Baseline JSON file to compare the results against.'),
+        make_option('--threshold', dest='threshold', type='float',
+            default=0.2,
+            help='Relative growth flagged as a regression (default 0.2).'),
+    )
+
+    def handle(self, *args, **options):
+        counts = dict([(t, options[t]) for t in benchmark.DEFAULT_COUNTS])
+        setup_test_environment()
+        runner = DjangoTestSuiteRunner(verbosity=0, interactive=False)
+        old_config = runner.setup_databases()
+        try:
+            results = benchmark.run(counts, options['choices'],
+                options['repeat'])
+        finally:
+            runner.teardown_databases(old_config)
+            teardown_test_environment()
+
+        for name in sorted(results):
+            r = results[name]
+            self.stdout.write('%-20s %8.2fms %5d queries %8dKB\n' % (name,
+                r['time'] * 1000, r['queries'], r['memory']))
+        if options['output']:
+            f = open(options['output'], 'w')
+            try:
+                json.dump({'counts': counts, 'choices': options['choices'],
+                    'results': results}, f, indent=2)
+            finally:
+                f.close()
+
+        if options['compare']:
+            f = open(options['compare'])
+            try:
+                baseline = json.load(f)
+            finally:
+                f.close()
+            regressions = benchmark.compare(results, baseline['results'],
+                options['threshold'])
+            for name, metric, old, new in regressions:
+                self.stdout.write('REGRESSION %s %s: %s -> %s\n' % (name,
+                    metric, old, new))
+            if regressions:
+                raise CommandError('%d regressions found.' % len(regressions))
@@ -0,0 +1,52 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dynamicforms.models import (DynamicForm, DynamicResponseSet, CHUNK_SIZE,
+    pack_responses, unpack_responses)
+from dynamicforms.utils import atomic
+
+
+class Command(BaseCommand):
+    args = '[<dynamicform_id> ...]'
+    help = ('Move the responses of the given forms, or of all forms, between '
+        'response rows and response set documents.')
+    option_list = BaseCommand.option_list + (
+        make_option('--to', dest='storage', default=None,
+            help='Target storage: document or rows.'),
+        make_option('--chunk-size', dest='chunk_size', type='int',
+            default=CHUNK_SIZE,
+            help='Number of response sets converted per transaction.'),
+    )
+
+    def handle(self, *args, **options):
+        convert = {
+            'document': pack_responses,
+            'rows': unpack_responses,
+        }.get(options['storage'])
+        if convert is None:
+            raise CommandError('--to must be document or rows.')
+        forms = []
+        for dynamicform_id in args:
+            try:
+                forms.append(DynamicForm.objects.get(pk=dynamicform_id))
+            except (DynamicForm.DoesNotExist, ValueError):
+                raise CommandError("Dynamic form '%s' does not exist." %
+                    dynamicform_id)
+
+        response_sets = DynamicResponseSet.objects.order_by('pk')
+        if forms:
+            response_sets = response_sets.filter(dynamic_form__in=forms)
+        if options['storage'] == 'rows':
+            response_sets = response_sets.exclude(document='')
+        last_pk = 0
+        n = 0
+        while True:
+            with atomic():
+                chunk = list(response_sets.filter(pk__gt=last_pk)
+                    [:options['chunk_size']])
+                if not chunk:
+                    break
+                n += convert(chunk)
+            last_pk = chunk[-1].pk
+        self.stdout.write('Converted %d responses.\n' % n)
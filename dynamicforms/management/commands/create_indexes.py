@@ -0,0 +1,25 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from dynamicforms import indexes
+
+
+class Command(BaseCommand):
+    help = "Create the composite indexes missing from the database."
+    option_list = BaseCommand.option_list + (
+        make_option('--database', dest='database', default=DEFAULT_DB_ALIAS,
+            help='Database to create the indexes in.'),
+        make_option('--sql', dest='sql', action='store_true', default=False,
+            help='Print the statements instead of running them.'),
+    )
+
+    def handle(self, *args, **options):
+        if options['sql']:
+            for sql in indexes.get_missing_indexes(options['database']):
+                self.stdout.write(sql + ';\n')
+            return
+        n = indexes.create_indexes(options['database'],
+            int(options['verbosity']), self.stdout)
+        self.stdout.write('Created %d indexes.\n' % n)
@@ -0,0 +1,53 @@
+import sys
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dynamicforms import export
+from dynamicforms.models import DynamicForm
+
+
+class Command(BaseCommand):
+    args = '<dynamicform_id>'
+    help = 'Export all the responses to a dynamic form as CSV or JSON lines.'
+    option_list = BaseCommand.option_list + (
+        make_option('--format', dest='format', default='csv',
+            help='Output format: csv (default) or jsonl.'),
+        make_option('--output', dest='output', default=None,
+            help='File to write to. Defaults to standard output.'),
+        make_option('--chunk-size', dest='chunk_size', type='int',
+            default=export.CHUNK_SIZE,
+            help='Number of response sets read per batch.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Usage: export_responses %s' % self.args)
+        try:
+            dynamicform = DynamicForm.objects.get(pk=args[0])
+        except (DynamicForm.DoesNotExist, ValueError):
+            raise CommandError("Dynamic form '%s' does not exist." % args[0])
+        format = options['format']
+        if format not in export.FORMATS:
+            raise CommandError("Unknown format '%s'." % format)
+
+        output = options['output']
+        out = open(output, 'wb') if output else self.stdout
+        stderr = getattr(self, 'stderr', sys.stderr)
+        start = time.time()
+        rows = 0
+        try:
+            lines = export.iter_export(dynamicform, format,
+                    options['chunk_size'])
+            if format == 'csv':
+                out.write(lines.next())
+            for line in lines:
+                out.write(line)
+                rows += 1
+        finally:
+            if output:
+                out.close()
+        elapsed = max(time.time() - start, 0.001)
+        stderr.write('Exported %d rows in %.1fs (%.0f rows/s).\n' %
+            (rows, elapsed, rows / elapsed))
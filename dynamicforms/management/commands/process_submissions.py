@@ -0,0 +1,31 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from dynamicforms import outbox
+
+
+class Command(BaseCommand):
+    help = 'Write queued dynamic form submissions to the database.'
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int',
+            default=outbox.BATCH_SIZE,
+            help='Number of submissions written per transaction.'),
+        make_option('--loop', dest='loop', action='store_true',
+            default=False,
+            help='Keep waiting for new submissions instead of exiting.'),
+        make_option('--interval', dest='interval', type='float', default=1.0,
+            help='Seconds to sleep when the queue is empty, with --loop.'),
+    )
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            n = outbox.process_pending(options['batch_size'])
+            total += n
+            if not n:
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+        self.stdout.write('Processed %d submissions.\n' % total)
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from dynamicforms.models import rebuild_latest_response_sets
+from dynamicforms.utils import atomic
+
+
+class Command(BaseCommand):
+    help = ('Recompute the latest response set and submission count of '
+        'every user and form from the response sets.')
+
+    def handle(self, *args, **options):
+        with atomic():
+            n = rebuild_latest_response_sets()
+        self.stdout.write('Rebuilt %d pointers.\n' % n)
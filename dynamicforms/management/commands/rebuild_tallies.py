@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from dynamicforms.models import DynamicForm, rebuild_tallies
+from dynamicforms.utils import atomic
+
+
+class Command(BaseCommand):
+    args = '[<dynamicform_id> ...]'
+    help = 'Recompute the answer tallies of the given forms, or of all forms.'
+
+    def handle(self, *args, **options):
+        forms = []
+        for dynamicform_id in args:
+            try:
+                forms.append(DynamicForm.objects.get(pk=dynamicform_id))
+            except (DynamicForm.DoesNotExist, ValueError):
+                raise CommandError("Dynamic form '%s' does not exist." %
+                    dynamicform_id)
+        with atomic():
+            if forms:
+                n = sum([rebuild_tallies(f) for f in forms])
+            else:
+                n = rebuild_tallies()
+        self.stdout.write('Rebuilt %d tallies.\n' % n)
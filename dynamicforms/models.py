@@ -1,16 +1,29 @@
+import heapq
 import itertools
+import time
+from collections import namedtuple
 from re import compile
 from datetime import datetime
+from uuid import uuid4
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
 
-from django.contrib import admin
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import models, IntegrityError
+from django.db import connections, router, transaction
+from django.db.models import Count, F, Max
+from django.db.models.signals import class_prepared, post_save, post_delete
 from django import forms
 from django.contrib.contenttypes import generic
 from django.contrib.contenttypes.models import ContentType
 from django.conf import settings
 
-from utils import get_class
+from utils import (get_class, atomic, bulk_create, bulk_delete,
+    insert_local_fields, insert_unless_exists)
+import schema
 
 
 class QuestionTypeRegisterError(Exception):
@@ -23,15 +36,65 @@ class QuestionTypeRegisterError(Exception):
 
 DYNAMICFORMS_CUSTOM_TYPES = getattr(settings, 'DYNAMICFORMS_CUSTOM_TYPES', {})
 
+RESPONSE_STORAGE = getattr(settings, 'DYNAMICFORMS_RESPONSE_STORAGE', 'rows')
+
+# Number of times writing a queued submission is tried before giving up.
+SUBMISSION_ATTEMPTS = getattr(settings, 'DYNAMICFORMS_SUBMISSION_ATTEMPTS', 5)
+
+# Number of response sets read at once when scanning documents.
+CHUNK_SIZE = 500
+
 
 DEFAULT_QUESTION_TYPES = (
     'dynamicforms.models.DynamicTextQuestion',
     'dynamicforms.models.DynamicYesNoQuestion',
     'dynamicforms.models.DynamicMultipleChoiceQuestion',
     'dynamicforms.models.DynamicRatingQuestion',
+    'dynamicforms.models.DynamicPageBreak',
 )
 
 
+class InheritanceResolveQuerySet(models.query.QuerySet):
+    """
+    A QuerySet that can downcast all of its rows to their child types at once.
+    """
+
+    def resolve(self):
+        """
+        Return a list of the rows in this QuerySet, each downcast to its
+        ``real_type``.
+
+        Rows are grouped by ``real_type`` and every concrete type is loaded
+        with a single ``pk__in`` query, so the number of queries depends on
+        the number of types rather than the number of rows. The ordering of
+        the QuerySet is kept.
+        """
+        items = list(self)
+        pks_by_type = {}
+        for item in items:
+            if item.real_type_id is None:
+                raise AttributeError(
+                    "Failed to access real type for %s with self.real_type=%s"
+                        % (item, None))
+            pks_by_type.setdefault(item.real_type_id, []).append(item.pk)
+        resolved = {}
+        for type_id, pks in pks_by_type.items():
+            model = QUESTION_TYPES.get_class_for_content_type_id(type_id)
+            for pk, obj in model._default_manager.using(self.db) \
+                    .in_bulk(pks).items():
+                resolved[(type_id, pk)] = obj
+        return [resolved[(item.real_type_id, item.pk)] for item in items]
+
+
+class InheritanceResolveManager(models.Manager):
+
+    def get_query_set(self):
+        return InheritanceResolveQuerySet(self.model, using=self._db)
+
+    def resolve(self):
+        return self.get_query_set().resolve()
+
+
 class InheritanceResolveModel(models.Model):
     """
     An abstract base class that provides a ``real_type`` FK to ContentType.
@@ -45,37 +108,222 @@ class InheritanceResolveModel(models.Model):
     real_type = models.ForeignKey(ContentType, editable=False, null=True,
             related_name="%(app_label)s_%(class)s_inheritance_related")
 
+    objects = InheritanceResolveManager()
+
     def save(self, *args, **kwargs):
         if not self.id:
             self.real_type = self._get_real_type()
         super(InheritanceResolveModel, self).save(*args, **kwargs)
 
     def _get_real_type(self):
-        return ContentType.objects.get_for_model(type(self))
+        return QUESTION_TYPES.get_content_type(type(self))
 
     def resolve(self):
-        try:
-            return self.real_type.get_object_for_this_type(pk=self.pk)
-        except AttributeError:
+        if self.real_type_id is None:
             raise AttributeError(
                 "Failed to access real type for %s with self.real_type=%s" %
-                    (self, self.real_type))
+                    (self, None))
+        model = QUESTION_TYPES.get_class_for_content_type_id(self.real_type_id)
+        return model._default_manager.get(pk=self.pk)
 
     class Meta:
         abstract = True
 
 
+def _initial_schema_version():
+    # Seeded from the clock so that a reused id never matches a schema
+    # cached for an earlier form.
+    return int(time.time() * 1000)
+
+
 class DynamicForm(models.Model):
     name = models.CharField(max_length=255)
     questions = generic.GenericRelation('DynamicFormQuestion')
+    # Incremented whenever a question or a choice changes; see
+    # ``bump_schema_version``.
+    schema_version = models.BigIntegerField(default=_initial_schema_version,
+            editable=False)
+    # The version shown to respondents, if any; see ``publish``.
+    published = models.ForeignKey('DynamicFormVersion', null=True,
+            blank=True, editable=False, related_name='+',
+            on_delete=models.SET_NULL)
+
+    def admin_url(self, action=None):
+        url = '/admin/dynamicforms/dynamicform/%d/' % self.id
+        if action:
+            url += '%s/' % action
+        return url
+
+    def get_questions(self):
+        """
+        Return the questions of this form resolved to their real types, with
+        the answers of choice-bearing questions already loaded.
+        """
+        return prefetch_choices(self.questions.all().resolve())
 
-    def admin_url(self):
-        return '/admin/dynamicforms/dynamicform/%d/' % self.id
+    def reorder_questions(self, order):
+        """
+        Renumber the questions of this form following ``order``, a list of
+        question ids, with a single UPDATE.
+
+        Raises ``ValueError`` unless ``order`` holds exactly the ids of this
+        form's questions.
+        """
+        order = [int(pk) for pk in order]
+        current = self.questions.values_list('pk', flat=True)
+        if sorted(order) != sorted(current):
+            raise ValueError("The question ids don't match the form's.")
+        if not order:
+            return
+        using = router.db_for_write(DynamicFormQuestion)
+        connection = connections[using]
+        qn = connection.ops.quote_name
+        sql = 'UPDATE %s SET %s = CASE %s %s END WHERE %s IN (%s)' % (
+            qn(DynamicFormQuestion._meta.db_table), qn('order'), qn('id'),
+            ' '.join(['WHEN %s THEN %s'] * len(order)), qn('id'),
+            ', '.join(['%s'] * len(order)))
+        params = []
+        for i, pk in enumerate(order):
+            params.extend([pk, i + 1])
+        connection.cursor().execute(sql, params + order)
+        transaction.commit_unless_managed(using)
+        bump_schema_version(self.pk)
+
+    def delete_questions(self, pks):
+        """
+        Delete the questions of this form whose ids are in ``pks``, with
+        their answers, responses and tallies, using a few set-based
+        statements. Ids of other forms' questions are ignored. Return the
+        number of deleted questions.
+        """
+        pks = list(self.questions.filter(pk__in=pks)
+            .values_list('pk', flat=True))
+        bulk_delete(DynamicFormQuestion, pks)
+        bump_schema_version(self.pk)
+        return len(pks)
+
+    def clone(self, name=None):
+        """
+        Copy this form, as a draft named ``name``, with its questions and
+        their choices in the same order, and return the copy.
+
+        Rows are inserted in bulk, one statement per model, inside a single
+        transaction, so the number of queries depends on the number of
+        question types rather than on the size of the form.
+        """
+        questions = self.get_questions()
+        with atomic():
+            copy = DynamicForm.objects.create(
+                name=name if name is not None else self.name)
+            if not questions:
+                return copy
+            for question in questions:
+                question.object_id = copy.pk
+            insert_local_fields(DynamicFormQuestion, questions)
+            # Ids are given in insertion order.
+            pks = DynamicFormQuestion.objects.filter(
+                content_type=questions[0].content_type_id,
+                object_id=copy.pk).order_by('pk').values_list('pk', flat=True)
+            levels = {}
+            for question, pk in zip(questions, pks):
+                question.id = pk
+                model = type(question)
+                while model._meta.parents:
+                    for field in model._meta.parents.values():
+                        setattr(question, field.attname, pk)
+                    levels.setdefault(model, []).append(question)
+                    model = model._meta.parents.keys()[0]
+            # Parents first.
+            for model in sorted(levels, key=_inheritance_depth):
+                insert_local_fields(model, levels[model])
+
+            answers = {}
+            for question in questions:
+                if getattr(question, 'choice_class', None) is None:
+                    continue
+                for answer in question.get_answers():
+                    answer.pk = None
+                    answer.question_id = question.pk
+                    answers.setdefault(question.choice_class, []).append(
+                        answer)
+            for choice_class, objs in answers.items():
+                bulk_create(choice_class, objs)
+        return copy
+
+    def publish(self):
+        """
+        Snapshot the current questions and choices of this form as a new
+        ``DynamicFormVersion`` and show that version to respondents. Later
+        edits only change the draft until the form is published again.
+        """
+        number = (self.versions.aggregate(n=Max('number'))['n'] or 0) + 1
+        version = DynamicFormVersion.objects.create(dynamic_form=self,
+            number=number, token=uuid4().hex,
+            snapshot=json.dumps(schema.take_snapshot(self.get_questions()),
+                separators=(',', ':')))
+        DynamicForm.objects.filter(pk=self.pk).update(published=version)
+        self.published = version
+        return version
+
+    def get_tallies(self):
+        """
+        Return how many times each answer was chosen, as a dict mapping
+        question ids to dicts of ``{answer key: count}``. Answer keys are
+        the choice values used by the form fields.
+        """
+        tallies = {}
+        for question_id, answer, count in self.dynamicanswertally_set \
+                .values_list('question', 'answer', 'count'):
+            tallies.setdefault(question_id, {})[answer] = count
+        return tallies
 
     def __unicode__(self):
         return self.name
 
 
+def _inheritance_depth(model):
+    depth = 0
+    while model._meta.parents:
+        model = model._meta.parents.keys()[0]
+        depth += 1
+    return depth
+
+
+class DynamicFormVersion(models.Model):
+    """
+    An immutable snapshot of the questions and choices of a form, taken by
+    ``DynamicForm.publish``.
+    """
+    dynamic_form = models.ForeignKey(DynamicForm, related_name='versions')
+    number = models.PositiveIntegerField()
+    published = models.DateTimeField(auto_now_add=True)
+    # Unique across databases, so cached schemas can't be mistaken for
+    # those of a version that reused a deleted version's id.
+    token = models.CharField(max_length=32, unique=True, editable=False)
+    snapshot = models.TextField(editable=False)
+
+    class Meta:
+        unique_together = (('dynamic_form', 'number'),)
+        ordering = ['dynamic_form', 'number']
+
+    def __unicode__(self):
+        return '%s, version %d' % (self.dynamic_form.name, self.number)
+
+    @property
+    def cache_key(self):
+        return '%d-%s' % (self.pk, self.token)
+
+    def get_snapshot(self):
+        """
+        Return the published questions as a list of dicts with their ``id``,
+        ``type``, ``question_text``, ``order`` and ``field``.
+        """
+        return json.loads(self.snapshot)
+
+    def get_schema(self):
+        return schema.get_published_schema(self)
+
+
 ###############################################################################
 # Questions
 ###############################################################################
@@ -95,7 +343,10 @@ class DynamicFormQuestion(InheritanceResolveModel):
         return "%s..." % self.question_text[:20]
 
     def admin_url(self):
-        return '/admin/dynamicforms/%s/%d/' % (self.real_type.model, self.id)
+        class_ = QUESTION_TYPES.get_class_for_content_type_id(
+                self.real_type_id)
+        return '/admin/dynamicforms/%s/%d/' % (class_._meta.module_name,
+                self.id)
 
     @classmethod
     def pretty_name(cls):
@@ -110,6 +361,41 @@ class DynamicFormQuestion(InheritanceResolveModel):
         raise NotImplementedError("My name is %s and I don't know how to save a response."
                 % cls)
 
+    def get_responses(self, user, response, response_set):
+        """
+        Return a list of unsaved response instances for ``response``.
+        ``DynamicFormCreator`` inserts them in bulk.
+
+        Question types that only implement ``save_response`` get it called
+        here instead, and return no rows.
+        """
+        type(self).save_response(user, self.pk, response, response_set)
+        return []
+
+    @classmethod
+    def overrides_save_response(cls):
+        """
+        Whether ``save_response`` is overridden further down the class
+        hierarchy than the ``get_responses`` in use, as in a subclass of a
+        built-in type written before ``get_responses`` existed.
+        """
+        def defined_at(name):
+            for i, class_ in enumerate(cls.__mro__):
+                if name in class_.__dict__:
+                    return i
+        return defined_at('save_response') < defined_at('get_responses')
+
+    def build_responses(self, user, response, response_set):
+        """
+        Return the unsaved response rows for ``response``, unless the type
+        overrides ``save_response`` below its ``get_responses``: that
+        override is called instead, and saves its own rows.
+        """
+        if self.overrides_save_response():
+            type(self).save_response(user, self.pk, response, response_set)
+            return []
+        return self.get_responses(user, response, response_set)
+
     def get_type(self):
         return str(self._get_real_type())
 
@@ -132,12 +418,16 @@ class DynamicTextQuestion(DynamicFormQuestion):
     @classmethod
     def save_response(cls, user, question_id, response, response_set):
         q = cls.objects.get(pk=question_id)
-        DynamicTextResponse.objects.create(
+        bulk_create(DynamicTextResponse,
+                q.get_responses(user, response, response_set))
+
+    def get_responses(self, user, response, response_set):
+        return [DynamicTextResponse(
             user=user,
-            question=q,
+            question=self,
             dynamic_response_set=response_set,
             text_response=response
-        )
+        )]
 
 
 class DynamicMultipleChoiceAnswer(models.Model):
@@ -154,8 +444,39 @@ class DynamicMultipleChoiceQuestion(DynamicFormQuestion):
     def pretty_name(cls):
         return "Multiple choice question"
 
+    def get_answers(self):
+        """
+        Return the answers to pick from, using the ones attached by
+        ``prefetch_choices`` if there are any.
+        """
+        if hasattr(self, '_answers_cache'):
+            return self._answers_cache
+        return self.choice_class.objects.filter(question=self.pk).order_by('pk')
+
+    def get_answers_by_id(self, ids):
+        """
+        Return a dict of this question's answers whose ids are in ``ids``.
+        Ids of answers to other questions are left out.
+        """
+        if hasattr(self, '_answers_cache'):
+            ids = set(ids)
+            return dict([(a.pk, a) for a in self._answers_cache
+                if a.pk in ids])
+        return self.choice_class.objects.filter(question=self.pk).in_bulk(ids)
+
+    def parse_answer_ids(self, responses):
+        """
+        Return the answer ids in a list of submitted choice names.
+        """
+        ids = []
+        for r in responses:
+            match = self.PATTERN.match(r)
+            if match:
+                ids.append(int(match.group(2)))
+        return ids
+
     def get_choices(self):
-        answers = self.dynamicmultiplechoiceanswer_set.all()
+        answers = self.get_answers()
         name = 'dynamic-multiple-choice-answer-%d'
         return [(name % a.pk, a.answer_text,) for a in answers]
 
@@ -168,19 +489,26 @@ class DynamicMultipleChoiceQuestion(DynamicFormQuestion):
     @classmethod
     def save_response(cls, user, question_id, responses, response_set):
         q = cls.objects.get(pk=question_id)
-        if responses:
-            for r in responses:
-                meta = cls.PATTERN.findall(r)[0]
-                answer = DynamicMultipleChoiceAnswer.objects.get(id=meta[1])
-                models.DynamicMultipleChoiceResponse.objects.create(
-                        user=user,
-                        question=q,
-                        dynamic_response_set=response_set,
-                        answer=answer)
+        rows = q.get_responses(user, responses, response_set)
+        if rows:
+            bulk_create(type(rows[0]), rows)
+
+    def get_responses(self, user, responses, response_set):
+        ids = self.parse_answer_ids(responses or [])
+        if not ids:
+            return []
+        answers = self.get_answers_by_id(ids)
+        return [DynamicMultipleChoiceResponse(
+                    user=user,
+                    question=self,
+                    dynamic_response_set=response_set,
+                    answer=answers[i]) for i in ids if i in answers]
 
 
 class DynamicYesNoQuestion(DynamicMultipleChoiceQuestion):
 
+    choice_class = None
+
     @classmethod
     def pretty_name(cls):
         return "Yes/No question"
@@ -195,15 +523,13 @@ class DynamicYesNoQuestion(DynamicMultipleChoiceQuestion):
                 choices=choices)
         return f, self.get_form_name()
 
-    @classmethod
-    def save_response(cls, user, question_id, response, response_set):
-        q = cls.objects.get(pk=question_id)
-        DynamicYesNoResponse.objects.create(
+    def get_responses(self, user, response, response_set):
+        return [DynamicYesNoResponse(
             user=user,
-            question=q,
+            question=self,
             response=True if response == 'yes' else False,
             dynamic_response_set=response_set
-        )
+        )]
 
 
 
@@ -214,7 +540,7 @@ class DynamicRatingQuestion(DynamicMultipleChoiceQuestion):
         return "Rating question"
 
     def get_choices(self):
-        answers = self.dynamicratinganswer_set.all()
+        answers = self.get_answers()
         name = 'dynamic-rating-answer-%d'
         return [(name % a.pk, a.answer_text,) for a in answers]
 
@@ -224,7 +550,15 @@ class DynamicRatingQuestion(DynamicMultipleChoiceQuestion):
                 choices=self.get_choices())
         return f, self.get_form_name()
 
-
+    def get_responses(self, user, response, response_set):
+        ids = self.parse_answer_ids([response] if response else [])
+        answers = self.get_answers_by_id(ids)
+        return [DynamicRatingResponse(
+            user=user,
+            question=self,
+            dynamic_response_set=response_set,
+            response=answers[i]
+        ) for i in ids if i in answers]
 
 
 class DynamicRatingAnswer(models.Model):
@@ -234,16 +568,121 @@ class DynamicRatingAnswer(models.Model):
     def __unicode__(self):
         return self.answer_text
 
+
+DynamicRatingQuestion.choice_class = DynamicRatingAnswer
+
+
+class DynamicPageBreak(DynamicFormQuestion):
+    """
+    Starts a new page when the form is shown in pages; it has no field and
+    is left out otherwise.
+    """
+
+    @classmethod
+    def pretty_name(cls):
+        return "Page break"
+
+    def display(self, user):
+        return None, self.get_form_name()
+
+    def get_responses(self, user, response, response_set):
+        return []
+
+
+def lost_choices(question, value, rows):
+    """
+    Return whether some of the choices picked in ``value``, a submitted
+    value of ``question``, are missing from ``rows``, the responses built
+    for it, because they were deleted.
+    """
+    if getattr(question, 'choice_class', None) is None or \
+            not hasattr(question, 'parse_answer_ids'):
+        return False
+    picked = value if isinstance(value, (list, tuple)) else [value]
+    return len(rows) < len(question.parse_answer_ids([v for v in picked
+        if v]))
+
+
+def prefetch_choices(questions):
+    """
+    Attach the answers of every choice-bearing question in ``questions`` to
+    it, with one query per answer model. Return ``questions``.
+    """
+    by_class = {}
+    for question in questions:
+        choice_class = getattr(question, 'choice_class', None)
+        if choice_class is not None:
+            question._answers_cache = []
+            by_class.setdefault(choice_class, {})[question.pk] = question
+    for choice_class, by_pk in by_class.items():
+        answers = choice_class.objects.filter(question__in=by_pk.keys())
+        for answer in answers.order_by('pk'):
+            question = by_pk[answer.question_id]
+            question._answers_cache.append(answer)
+    return questions
+
 ###############################################################################
 # Responses
 ###############################################################################
 
 
+class DynamicResponseSetManager(models.Manager):
+
+    def upsert(self, user, dynamic_form, interviewer=None,
+            form_version=None):
+        """
+        Return ``(response_set, created)`` for the response set shared by
+        ``user``, ``dynamic_form`` and ``interviewer`` for submissions
+        against ``form_version``, creating it if needed. Each published
+        version gets its own set, so answers are never attributed to another
+        version's questions.
+
+        The set is identified by its ``unique_key``, so concurrent calls
+        can't create duplicates; see ``utils.insert_unless_exists``.
+        """
+        key = DynamicResponseSet.get_unique_key(user.pk, dynamic_form.pk,
+            interviewer.pk if interviewer is not None else None,
+            form_version.pk if form_version is not None else None)
+        try:
+            response_set = self.get(unique_key=key)
+        except self.model.DoesNotExist:
+            using = router.db_for_write(self.model)
+            response_set = self.model(user=user, dynamic_form=dynamic_form,
+                interviewer=interviewer, unique_key=key,
+                form_version=form_version)
+            if insert_unless_exists(response_set, 'unique_key', using):
+                return response_set, True
+            response_set = self.using(using).get(unique_key=key)
+        return response_set, False
+
+
 class DynamicResponseSet(models.Model):
     user = models.ForeignKey(User)
     dynamic_form = models.ForeignKey(DynamicForm)
     added = models.DateTimeField(auto_now_add=True)
     interviewer = models.ForeignKey(User, null=True, related_name="responsesets_as_interviewer")
+    # Responses saved with the 'document' storage, as JSON mapping question
+    # ids to lists of values. See ``save_responses``.
+    document = models.TextField(blank=True, default='')
+    # Set on the one response set shared by a user, form and interviewer
+    # (see ``DynamicResponseSetManager.upsert``); null for sets created with
+    # ``force_new_set``.
+    unique_key = models.CharField(max_length=64, null=True, unique=True,
+            editable=False)
+    # The published version the submissions were made against.
+    form_version = models.ForeignKey(DynamicFormVersion, null=True,
+            blank=True, on_delete=models.SET_NULL)
+
+    objects = DynamicResponseSetManager()
+
+    @staticmethod
+    def get_unique_key(user_id, dynamic_form_id, interviewer_id=None,
+            form_version_id=None):
+        key = '%d:%d:%s' % (user_id, dynamic_form_id,
+            interviewer_id if interviewer_id is not None else '')
+        if form_version_id is not None:
+            key += ':v%d' % form_version_id
+        return key
 
     def __unicode__(self):
         t = self.added.strftime("%m/%d/%y")
@@ -252,25 +691,68 @@ class DynamicResponseSet(models.Model):
 
     @property
     def responses(self):
-        return list(list(self.dynamicmultiplechoiceresponse_set.all()) + \
-            list(self.dynamictextresponse_set.all()) +
-            list(self.dynamicratingresponse_set.all()) + \
-            list(self.dynamicyesnoresponse_set.all()))
+        return list(list(self.dynamicmultiplechoiceresponse_set.select_related(
+                *DynamicMultipleChoiceResponse.related_fields)) + \
+            list(self.dynamictextresponse_set.select_related(
+                *DynamicTextResponse.related_fields)) +
+            list(self.dynamicratingresponse_set.select_related(
+                *DynamicRatingResponse.related_fields)) + \
+            list(self.dynamicyesnoresponse_set.select_related(
+                *DynamicYesNoResponse.related_fields)) +
+            _load_documents([(self.pk, self.user_id, self.added,
+                self.document)])[0])
+
+    def get_document(self):
+        return json.loads(self.document) if self.document else {}
+
+    def set_document(self, document):
+        self.document = json.dumps(document, separators=(',', ':')) \
+            if document else ''
+
+    @property
+    def records(self):
+        """
+        The responses of this set as ``ResponseRecord``s, in question order.
+        """
+        return list(iter_records([self]))
 
 
 class DynamicResponse(models.Model):
     user = models.ForeignKey(User)
-    submitted = models.DateTimeField(default=datetime.utcnow())
+    submitted = models.DateTimeField(default=datetime.utcnow)
     dynamic_response_set = models.ForeignKey(DynamicResponseSet)
 
+    # Name of the field holding the chosen answer, for response types that
+    # are counted in ``DynamicAnswerTally``.
+    tally_field = None
+    # Name of the field whose value is kept in ``DynamicResponseSet.document``
+    # by the 'document' storage; responses without one are always rows.
+    document_field = None
+
     class Meta:
         abstract = True
 
+    @classmethod
+    def tally_key(cls, value):
+        """
+        Return the answer key under which a ``tally_field`` value is counted.
+        """
+        raise NotImplementedError
+
+    def get_tally_key(self):
+        if self.tally_field is None:
+            return None
+        field = self._meta.get_field(self.tally_field)
+        return self.tally_key(getattr(self, field.attname))
+
 
 class DynamicTextResponse(DynamicResponse):
     text_response = models.TextField()
     question = models.ForeignKey(DynamicTextQuestion)
 
+    related_fields = ('question',)
+    document_field = 'text_response'
+
     def __unicode__(self):
         return self.text_response
 
@@ -279,6 +761,14 @@ class DynamicMultipleChoiceResponse(DynamicResponse):
     question = models.ForeignKey(DynamicMultipleChoiceQuestion)
     answer = models.ForeignKey(DynamicMultipleChoiceAnswer)
 
+    related_fields = ('question', 'answer')
+    tally_field = 'answer'
+    document_field = 'answer'
+
+    @classmethod
+    def tally_key(cls, value):
+        return 'dynamic-multiple-choice-answer-%d' % value
+
     def __unicode__(self):
         return self.answer.answer_text
 
@@ -287,6 +777,14 @@ class DynamicYesNoResponse(DynamicResponse):
     question = models.ForeignKey(DynamicYesNoQuestion)
     response = models.BooleanField()
 
+    related_fields = ('question',)
+    tally_field = 'response'
+    document_field = 'response'
+
+    @classmethod
+    def tally_key(cls, value):
+        return 'yes' if value else 'no'
+
     def __unicode__(self):
         if self.response:
             return 'Yes'
@@ -298,10 +796,619 @@ class DynamicRatingResponse(DynamicResponse):
     question = models.ForeignKey(DynamicRatingQuestion)
     response = models.ForeignKey(DynamicRatingAnswer)
 
+    related_fields = ('question', 'response')
+    tally_field = 'response'
+    document_field = 'response'
+
+    @classmethod
+    def tally_key(cls, value):
+        return 'dynamic-rating-answer-%d' % value
+
     def __unicode__(self):
         return self.response.answer_text
 
 
+RESPONSE_MODELS = (
+    DynamicTextResponse,
+    DynamicYesNoResponse,
+    DynamicMultipleChoiceResponse,
+    DynamicRatingResponse,
+)
+
+
+def get_response_model(question_class):
+    """
+    Return the model of ``RESPONSE_MODELS`` storing the responses to
+    ``question_class`` or its closest parent, or ``None``.
+    """
+    for cls in question_class.__mro__:
+        for model in RESPONSE_MODELS:
+            if model._meta.get_field('question').rel.to is cls:
+                return model
+    return None
+
+
+def _document_value(response):
+    field = response._meta.get_field(response.document_field)
+    return getattr(response, field.attname)
+
+
+def save_responses(responses, storage=None):
+    """
+    Save ``responses``, a list of unsaved response instances.
+
+    With the default 'rows' storage (``DYNAMICFORMS_RESPONSE_STORAGE``) they
+    are inserted with one query per response model. With the 'document'
+    storage, the values of the built-in response types are added to the
+    ``document`` of their response set instead: each set is locked, its
+    document read again and then updated. Should be called inside a
+    transaction, so that concurrent submissions to a set merge in turn.
+    """
+    storage = storage or RESPONSE_STORAGE
+    if storage not in ('rows', 'document'):
+        raise ValueError("Unknown response storage '%s'." % storage)
+    rows = {}
+    documented = []
+    for response in responses:
+        if storage == 'document' and response.document_field is not None:
+            documented.append(response)
+        else:
+            rows.setdefault(type(response), []).append(response)
+    for model, objs in rows.items():
+        bulk_create(model, objs)
+    _lock_documents([r.dynamic_response_set for r in documented])
+    for response_set in _add_to_documents(documented):
+        DynamicResponseSet.objects.filter(pk=response_set.pk) \
+            .update(document=response_set.document)
+
+
+def _lock_documents(response_sets):
+    """
+    Lock the rows of ``response_sets`` until the end of the transaction, in
+    id order, and reload their ``document``.
+    """
+    by_id = {}
+    for response_set in response_sets:
+        by_id.setdefault(response_set.pk, []).append(response_set)
+    for pk in sorted(by_id):
+        # A no-op UPDATE takes the row lock on every backend.
+        DynamicResponseSet.objects.filter(pk=pk) \
+            .update(document=F('document'))
+        document = DynamicResponseSet.objects.filter(pk=pk) \
+            .values_list('document', flat=True)[0]
+        for response_set in by_id[pk]:
+            response_set.document = document
+
+
+def _add_to_documents(responses):
+    """
+    Add the values of ``responses`` to the ``document`` of their response
+    set instances, without saving them. Return the changed response sets.
+    """
+    documents = {}
+    for response in responses:
+        response_set = response.dynamic_response_set
+        documents.setdefault(response_set.pk, (response_set, []))[1] \
+            .append(response)
+    for response_set, objs in documents.values():
+        document = response_set.get_document()
+        for response in objs:
+            document.setdefault(str(response.question_id), []).append(
+                _document_value(response))
+        response_set.set_document(document)
+    return [response_set for response_set, objs in documents.values()]
+
+
+def _load_documents(documents):
+    """
+    Turn ``documents``, a list of ``(response_set_id, user_id, added,
+    document)``, into unsaved response instances with their related objects
+    loaded. Return them, in document order, with a dict mapping question ids
+    to their ``(order, question_text)``.
+
+    Values of deleted questions and choices are skipped.
+    """
+    parsed = [(set_id, user_id, added, json.loads(document))
+        for set_id, user_id, added, document in documents if document]
+    question_ids = set([int(key) for doc in parsed for key in doc[3]])
+    if not question_ids:
+        return [], {}
+    questions = {}
+    for pk, real_type, order, text in DynamicFormQuestion.objects.filter(
+            pk__in=question_ids).values_list('pk', 'real_type', 'order',
+            'question_text'):
+        model = get_response_model(
+            QUESTION_TYPES.get_class_for_content_type_id(real_type))
+        if model is not None:
+            questions[pk] = (model, order, text)
+
+    responses = []
+    for set_id, user_id, added, document in parsed:
+        items = [(int(key), values) for key, values in document.items()
+            if int(key) in questions]
+        items.sort(key=lambda item: (questions[item[0]][1], item[0]))
+        for key, values in items:
+            model = questions[key][0]
+            attname = model._meta.get_field(model.document_field).attname
+            for value in values:
+                responses.append(model(dynamic_response_set_id=set_id,
+                    user_id=user_id, submitted=added, question_id=key,
+                    **{attname: value}))
+
+    missing = set()
+    for model in set([type(r) for r in responses]):
+        objs = [r for r in responses if type(r) is model]
+        for name in model.related_fields:
+            if name == 'question':
+                continue
+            field = model._meta.get_field(name)
+            related = field.rel.to._default_manager.in_bulk(
+                set([getattr(r, field.attname) for r in objs]))
+            for r in objs:
+                obj = related.get(getattr(r, field.attname))
+                if obj is None:
+                    missing.add(id(r))
+                else:
+                    setattr(r, name, obj)
+    responses = [r for r in responses if id(r) not in missing]
+    return responses, dict([(pk, q[1:]) for pk, q in questions.items()])
+
+
+def _load_rows(response_sets):
+    """
+    Return the response rows of ``response_sets``, attached to the given
+    response set instances.
+    """
+    by_id = dict([(s.pk, s) for s in response_sets])
+    responses = []
+    for model in RESPONSE_MODELS:
+        objs = list(model.objects.filter(dynamic_response_set__in=by_id)
+            .order_by('pk'))
+        for r in objs:
+            r.dynamic_response_set = by_id[r.dynamic_response_set_id]
+        responses.extend(objs)
+    return responses
+
+
+def pack_responses(response_sets):
+    """
+    Move the response rows of ``response_sets``, a list of
+    ``DynamicResponseSet`` instances, into their documents. Should be called
+    inside a transaction.
+    """
+    responses = _load_rows(response_sets)
+    save_responses(responses, 'document')
+    for model in RESPONSE_MODELS:
+        bulk_delete(model, [r.pk for r in responses if type(r) is model])
+    return len(responses)
+
+
+def unpack_responses(response_sets):
+    """
+    Turn the documents of ``response_sets``, a list of ``DynamicResponseSet``
+    instances, back into response rows. Should be called inside a
+    transaction.
+    """
+    documents = [(s.pk, s.user_id, s.added, s.document)
+        for s in response_sets if s.document]
+    responses = _load_documents(documents)[0]
+    save_responses(responses, 'rows')
+    DynamicResponseSet.objects.filter(pk__in=[d[0] for d in documents]) \
+        .update(document='')
+    return len(responses)
+
+
+class DynamicSubmissionManager(models.Manager):
+
+    def pending(self):
+        return self.get_query_set().filter(processed__isnull=True,
+            attempts__lt=SUBMISSION_ATTEMPTS)
+
+    def failed(self):
+        return self.get_query_set().filter(processed__isnull=True,
+            attempts__gte=SUBMISSION_ATTEMPTS)
+
+
+class DynamicSubmission(models.Model):
+    """
+    A validated submission waiting to be written as a response set.
+
+    ``DynamicFormCreator`` stores submissions here instead of saving them
+    when queueing is enabled; ``outbox.process_pending`` writes them later.
+    """
+    token = models.CharField(max_length=32, unique=True)
+    dynamic_form = models.ForeignKey(DynamicForm)
+    user = models.ForeignKey(User)
+    interviewer = models.ForeignKey(User, null=True,
+            related_name="submissions_as_interviewer")
+    force_new_set = models.BooleanField(default=False)
+    form_version = models.ForeignKey(DynamicFormVersion, null=True,
+            blank=True, on_delete=models.SET_NULL)
+    payload = models.TextField()
+    added = models.DateTimeField(default=datetime.utcnow)
+    worker = models.CharField(max_length=32, blank=True)
+    processed = models.DateTimeField(null=True, blank=True)
+    response_set = models.ForeignKey(DynamicResponseSet, null=True,
+            blank=True, on_delete=models.SET_NULL)
+    # Failed attempts to write the submission, and the last error.
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    objects = DynamicSubmissionManager()
+
+    def __unicode__(self):
+        return "%s' submission to %s (%s)" % (self.user.username,
+                self.dynamic_form.name, self.token)
+
+    @property
+    def is_pending(self):
+        return self.processed is None and \
+            self.attempts < SUBMISSION_ATTEMPTS
+
+
+class LatestResponseSet(models.Model):
+    """
+    The latest response set of a user to a form and how many times the user
+    submitted the form, kept up to date by ``record_submissions``.
+    """
+    user = models.ForeignKey(User, related_name="latestresponsesets")
+    dynamic_form = models.ForeignKey(DynamicForm)
+    response_set = models.ForeignKey(DynamicResponseSet, null=True,
+            blank=True, on_delete=models.SET_NULL)
+    submissions = models.PositiveIntegerField(default=0)
+    submitted = models.DateTimeField()
+
+    class Meta:
+        unique_together = (('user', 'dynamic_form'),)
+
+    def __unicode__(self):
+        return "%s' latest responses to %s" % (self.user.username,
+                self.dynamic_form.name)
+
+
+def record_submissions(user, dynamic_form, response_set, count=1):
+    """
+    Count ``count`` submissions of ``dynamic_form`` by ``user``, the last of
+    which was saved to ``response_set``. Costs a single UPDATE once the
+    user's pointer exists. Should be called inside a transaction.
+    """
+    # Local time, like ``DynamicResponseSet.added``.
+    now = datetime.now()
+    pointers = LatestResponseSet.objects.filter(user=user,
+        dynamic_form=dynamic_form)
+    values = {'response_set': response_set, 'submitted': now,
+        'submissions': F('submissions') + count}
+    if pointers.update(**values):
+        return
+    pointer = LatestResponseSet(user=user, dynamic_form=dynamic_form,
+        response_set=response_set, submissions=count, submitted=now)
+    if not insert_unless_exists(pointer, ('user', 'dynamic_form')):
+        # Another submission created it first.
+        pointers.update(**values)
+
+
+def get_latest_response_sets(user, dynamic_forms):
+    """
+    Return a dict mapping the ids of those of ``dynamic_forms`` (instances
+    or ids) that ``user`` submitted to their ``LatestResponseSet``, with a
+    single query.
+    """
+    ids = [getattr(f, 'pk', f) for f in dynamic_forms]
+    return dict([(p.dynamic_form_id, p) for p in LatestResponseSet.objects
+        .filter(user=user, dynamic_form__in=ids)])
+
+
+def rebuild_latest_response_sets():
+    """
+    Recompute every ``LatestResponseSet`` from the live response sets. The
+    number of submissions to a reused set can't be recovered, so each set
+    counts as one. Should be called inside a transaction. Return the
+    number of pointers.
+    """
+    LatestResponseSet.objects.all().delete()
+    groups = DynamicResponseSet.objects.values('user', 'dynamic_form') \
+        .annotate(latest=Max('pk'), submitted=Max('added'), n=Count('pk')) \
+        .order_by()
+    pointers = [LatestResponseSet(user_id=g['user'],
+        dynamic_form_id=g['dynamic_form'], response_set_id=g['latest'],
+        submissions=g['n'], submitted=g['submitted']) for g in groups]
+    bulk_create(LatestResponseSet, pointers)
+    return len(pointers)
+
+
+class ArchivedResponseSet(models.Model):
+    """
+    A response set moved out of ``DynamicResponseSet`` by
+    ``archive_response_sets``, with all its responses kept in ``document``.
+    It keeps the id of the original set, so ``iter_records`` and the exports
+    read it like a live one.
+    """
+    id = models.IntegerField(primary_key=True)
+    user = models.ForeignKey(User, related_name="archivedresponsesets")
+    dynamic_form = models.ForeignKey(DynamicForm)
+    added = models.DateTimeField(db_index=True)
+    interviewer = models.ForeignKey(User, null=True,
+            related_name="archivedresponsesets_as_interviewer")
+    document = models.TextField(blank=True, default='')
+    form_version = models.ForeignKey(DynamicFormVersion, null=True,
+            blank=True, on_delete=models.SET_NULL)
+    archived = models.DateTimeField(default=datetime.utcnow)
+
+    def __unicode__(self):
+        t = self.added.strftime("%m/%d/%y")
+        return "%s' archived responses to %s (%s)" % (self.user.username,
+                self.dynamic_form.name, t)
+
+    @property
+    def responses(self):
+        return _load_documents([(self.pk, self.user_id, self.added,
+            self.document)])[0]
+
+    @property
+    def records(self):
+        return list(iter_records([self]))
+
+
+def assign_unique_keys():
+    """
+    Set the ``unique_key`` of the latest response set of every user, form,
+    interviewer and form version which has none yet, so that ``upsert`` reuses the sets
+    created before keys existed. Should be called inside a transaction.
+    Return the number of keys set.
+    """
+    keyed = set(DynamicResponseSet.objects.filter(unique_key__isnull=False)
+        .values_list('unique_key', flat=True))
+    latest = DynamicResponseSet.objects.filter(unique_key__isnull=True) \
+        .values('user', 'dynamic_form', 'interviewer', 'form_version') \
+        .annotate(latest=Max('pk')).order_by()
+    n = 0
+    for group in latest:
+        key = DynamicResponseSet.get_unique_key(group['user'],
+            group['dynamic_form'], group['interviewer'],
+            group['form_version'])
+        if key not in keyed:
+            DynamicResponseSet.objects.filter(pk=group['latest']) \
+                .update(unique_key=key)
+            n += 1
+    return n
+
+
+def archive_response_sets(response_sets):
+    """
+    Move ``response_sets``, a list of ``DynamicResponseSet`` instances, and
+    their responses to ``ArchivedResponseSet``, with a fixed number of
+    queries. Tallies are left untouched. Should be called inside a
+    transaction. Return the number of archived sets.
+    """
+    _add_to_documents(_load_rows(response_sets))
+    now = datetime.utcnow()
+    bulk_create(ArchivedResponseSet, [ArchivedResponseSet(id=s.pk,
+        user_id=s.user_id, dynamic_form_id=s.dynamic_form_id, added=s.added,
+        interviewer_id=s.interviewer_id, document=s.document,
+        form_version_id=s.form_version_id, archived=now)
+        for s in response_sets])
+    pks = [s.pk for s in response_sets]
+    # Also deletes the response rows, and detaches the submissions and
+    # latest response set pointers.
+    bulk_delete(DynamicResponseSet, pks)
+    return len(pks)
+
+
+class DynamicAnswerTally(models.Model):
+    """
+    How many times an answer was chosen for a question.
+
+    Kept up to date by ``DynamicFormCreator.save_data`` through
+    ``increment_tallies``, and recomputed by the ``rebuild_tallies``
+    command.
+    """
+    dynamic_form = models.ForeignKey(DynamicForm)
+    question = models.ForeignKey(DynamicFormQuestion)
+    answer = models.CharField(max_length=100)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = (('question', 'answer'),)
+
+    def __unicode__(self):
+        return '%s: %d' % (self.answer, self.count)
+
+
+def increment_tallies(dynamicform, responses):
+    """
+    Count ``responses``, a list of response instances to ``dynamicform``,
+    in ``DynamicAnswerTally``.
+
+    Existing tallies are updated with one UPDATE per distinct increment and
+    missing ones inserted at once, so the number of queries doesn't grow with
+    the number of questions. Should be called inside a transaction.
+    """
+    counts = {}
+    for response in responses:
+        key = response.get_tally_key()
+        if key is not None:
+            key = (response.question_id, key)
+            counts[key] = counts.get(key, 0) + 1
+    if not counts:
+        return
+
+    question_ids = set([question_id for question_id, answer in counts])
+    existing = {}
+    for pk, question_id, answer in DynamicAnswerTally.objects.filter(
+            question__in=question_ids).values_list('pk', 'question', 'answer'):
+        if (question_id, answer) in counts:
+            existing[(question_id, answer)] = pk
+
+    by_increment = {}
+    missing = []
+    for key, n in counts.items():
+        if key in existing:
+            by_increment.setdefault(n, []).append(existing[key])
+        else:
+            missing.append(DynamicAnswerTally(dynamic_form=dynamicform,
+                question_id=key[0], answer=key[1], count=n))
+    for n, pks in by_increment.items():
+        DynamicAnswerTally.objects.filter(pk__in=pks) \
+            .update(count=F('count') + n)
+
+    if missing:
+        sid = transaction.savepoint()
+        try:
+            bulk_create(DynamicAnswerTally, missing)
+        except IntegrityError:
+            # Another submission created some of them first.
+            transaction.savepoint_rollback(sid)
+            for tally in missing:
+                _increment_tally(tally)
+        else:
+            transaction.savepoint_commit(sid)
+
+
+def _increment_tally(tally):
+    updated = DynamicAnswerTally.objects.filter(question=tally.question_id,
+        answer=tally.answer).update(count=F('count') + tally.count)
+    if not updated:
+        tally.save()
+
+
+def rebuild_tallies(dynamicform=None):
+    """
+    Recompute ``DynamicAnswerTally`` from the responses, for one form or for
+    all of them, with one GROUP BY query per response model. Responses kept
+    in documents, live or archived, are counted in chunks of ``CHUNK_SIZE``
+    response sets.
+    """
+    tallies = DynamicAnswerTally.objects.all()
+    if dynamicform is not None:
+        tallies = tallies.filter(dynamic_form=dynamicform)
+    tallies.delete()
+    counts = {}
+    for model in RESPONSE_MODELS:
+        if model.tally_field is None:
+            continue
+        responses = model.objects.all()
+        if dynamicform is not None:
+            responses = responses.filter(
+                dynamic_response_set__dynamic_form=dynamicform)
+        groups = responses.values('dynamic_response_set__dynamic_form',
+            'question', model.tally_field).annotate(n=Count('pk')) \
+            .order_by()
+        for group in groups:
+            key = (group['dynamic_response_set__dynamic_form'],
+                group['question'], model.tally_key(group[model.tally_field]))
+            counts[key] = counts.get(key, 0) + group['n']
+
+    for model in (DynamicResponseSet, ArchivedResponseSet):
+        response_sets = model.objects.exclude(document='')
+        if dynamicform is not None:
+            response_sets = response_sets.filter(dynamic_form=dynamicform)
+        last_pk = 0
+        while True:
+            chunk = list(response_sets.filter(pk__gt=last_pk).order_by('pk')
+                .values_list('pk', 'user', 'added', 'document',
+                    'dynamic_form')[:CHUNK_SIZE])
+            if not chunk:
+                break
+            form_ids = dict([(c[0], c[4]) for c in chunk])
+            for r in _load_documents([c[:4] for c in chunk])[0]:
+                answer = r.get_tally_key()
+                if answer is not None:
+                    key = (form_ids[r.dynamic_response_set_id],
+                        r.question_id, answer)
+                    counts[key] = counts.get(key, 0) + 1
+            last_pk = chunk[-1][0]
+
+    rows = [DynamicAnswerTally(dynamic_form_id=form_id,
+        question_id=question_id, answer=answer, count=n)
+        for (form_id, question_id, answer), n in counts.items()]
+    bulk_create(DynamicAnswerTally, rows)
+    return len(rows)
+
+
+class ResponseRecord(namedtuple('ResponseRecord',
+        'response_set_id question_id question_text type value')):
+    """
+    A lightweight, read-only view of a single response.
+
+        * ``response_set_id`` - id of the ``DynamicResponseSet``
+        * ``question_id``     - id of the question
+        * ``question_text``   - wording of the question
+        * ``type``            - slug of the question type
+        * ``value``           - the response rendered as text
+    """
+    __slots__ = ()
+
+
+def _sorted_records(model, ids):
+    responses = model.objects.filter(dynamic_response_set__in=ids) \
+        .select_related(*model.related_fields) \
+        .order_by('dynamic_response_set', 'question__order', 'question',
+            'pk')
+    for r in responses.iterator():
+        q = r.question
+        yield ((r.dynamic_response_set_id, q.order, q.pk, r.pk),
+            ResponseRecord(r.dynamic_response_set_id, q.pk, q.question_text,
+                q._meta.module_name, unicode(r)))
+
+
+def _get_documents(ids):
+    """
+    Return ``(response_set_id, user_id, added, document)`` for the response
+    sets in ``ids``. Archived sets are only looked up when some ids aren't
+    live.
+    """
+    fields = ('pk', 'user', 'added', 'document')
+    documents = list(DynamicResponseSet.objects.filter(pk__in=ids)
+        .values_list(*fields))
+    missing = set(ids) - set([d[0] for d in documents])
+    if missing:
+        documents.extend(ArchivedResponseSet.objects.filter(pk__in=missing)
+            .values_list(*fields))
+    return documents
+
+
+def _sorted_document_records(ids):
+    responses, questions = _load_documents(_get_documents(ids))
+    records = []
+    for i, r in enumerate(responses):
+        order, text = questions[r.question_id]
+        question_type = r._meta.get_field('question').rel.to._meta.module_name
+        records.append(((r.dynamic_response_set_id, order, r.question_id, i),
+            ResponseRecord(r.dynamic_response_set_id, r.question_id, text,
+                question_type, unicode(r))))
+    records.sort()
+    return records
+
+
+def iter_records(response_sets):
+    """
+    Yield a ``ResponseRecord`` for every response in ``response_sets``, a
+    list of ``DynamicResponseSet`` instances or ids.
+
+    There is one query per response model plus one for the documents, and
+    one more when some of the sets are archived, whatever the number of
+    sets. Records are ordered by response set, then by question order.
+    """
+    ids = [getattr(s, 'pk', s) for s in response_sets]
+    if not ids:
+        return
+    streams = [_sorted_records(model, ids) for model in RESPONSE_MODELS]
+    streams.append(_sorted_document_records(ids))
+    for key, record in heapq.merge(*streams):
+        yield record
+
+
+def get_records(response_sets):
+    """
+    Return a dict mapping the id of each of ``response_sets`` to the list of
+    its ``ResponseRecord``s.
+    """
+    records = dict([(getattr(s, 'pk', s), []) for s in response_sets])
+    for record in iter_records(records.keys()):
+        records[record.response_set_id].append(record)
+    return records
+
+
 ##############################################################################
 # Magic follows
 ##############################################################################
@@ -332,43 +1439,139 @@ def register_questions_types(*tuples):
     return question_types
 
 
-QUESTION_TYPES = register_questions_types(DEFAULT_QUESTION_TYPES,
-        DYNAMICFORMS_CUSTOM_TYPES)
-
-
-def _get_creation_choices():
+class QuestionTypeRegistry(object):
     """
-    Get choices for the *Add content* drop down in the admin.
+    The registered question types, indexed by slug, model class and content
+    type id. Iterating over it yields the ``dicts`` described in
+    ``register_questions_types``.
+
+    The types are registered on first use, and their content types are
+    looked up once, the first time one of them is needed. After that no
+    lookup touches the database.
     """
-    # TODO:  Use url reversal rather than hard-wiring URL
-    choices = [('', '------')]
-    for question_type in QUESTION_TYPES:
-        app_label = question_type['class']._meta.app_label
-        c = ('/admin/%s/%s/add/' % (app_label, question_type['slug']),
-                question_type['pretty_name'])
-        choices.append(c)
-    return choices
 
+    def __init__(self, *tuples):
+        self._tuples = tuples
+        self._types = None
+        self._by_slug = {}
+        self._by_class = {}
+        self._content_types = None
+        self._by_content_type_id = {}
+
+    def _load(self):
+        if self._types is None:
+            types = register_questions_types(*self._tuples)
+            self._by_slug = dict([(t['slug'], t) for t in types])
+            self._by_class = dict([(t['class'], t) for t in types])
+            self._types = types
+        return self._types
+
+    def _load_content_types(self):
+        if self._content_types is None:
+            content_types = {}
+            for t in self._load():
+                content_types[t['class']] = \
+                    ContentType.objects.get_for_model(t['class'])
+            self._by_content_type_id = dict(
+                [(ct.pk, class_) for class_, ct in content_types.items()])
+            self._content_types = content_types
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+    def get_by_slug(self, slug):
+        """
+        Return the type registered under ``slug``. Raises ``KeyError``.
+        """
+        self._load()
+        return self._by_slug[slug]
 
-CHOICES = _get_creation_choices()
-from admin import DynamicFormQuestionAdmin
+    def get_by_class(self, class_):
+        """
+        Return the type of the model ``class_``. Raises ``KeyError``.
+        """
+        self._load()
+        return self._by_class[class_]
+
+    def get_content_type(self, class_):
+        """
+        Return the ``ContentType`` of a question model.
+        """
+        self._load_content_types()
+        try:
+            return self._content_types[class_]
+        except KeyError:
+            ct = ContentType.objects.get_for_model(class_)
+            self._content_types[class_] = ct
+            # Proxy models share the content type of their concrete model,
+            # which keeps resolving to that model.
+            self._by_content_type_id.setdefault(ct.pk, class_)
+            return ct
+
+    def get_class_for_content_type_id(self, content_type_id):
+        """
+        Return the question model with the given content type id.
+        """
+        self._load_content_types()
+        try:
+            return self._by_content_type_id[content_type_id]
+        except KeyError:
+            ct = ContentType.objects.get_for_id(content_type_id)
+            class_ = ct.model_class()
+            self._content_types[class_] = ct
+            self._by_content_type_id[content_type_id] = class_
+            return class_
+
+
+QUESTION_TYPES = QuestionTypeRegistry(DEFAULT_QUESTION_TYPES,
+        DYNAMICFORMS_CUSTOM_TYPES)
 
 
-def register_admin():
+def bump_schema_version(dynamicform_id):
     """
-    Register question types in Django admin
+    Invalidate the cached schema of a form by incrementing its
+    ``schema_version``, as part of the current transaction.
     """
-    for t in QUESTION_TYPES:
-        class_ = t['class']
-        class admin_class(DynamicFormQuestionAdmin):
-            model = class_
+    DynamicForm.objects.filter(pk=dynamicform_id).update(
+        schema_version=F('schema_version') + 1)
 
-        if hasattr(class_, 'choice_class'):
-            inline_class = admin.StackedInline
-            inline_class.model = class_.choice_class
-            admin_class.inlines = [inline_class]
 
-        admin.site.register(class_, admin_class)
+def invalidate_schema(sender, instance, **kwargs):
+    """
+    Bump the schema version of the form a question or a choice belongs to.
+    """
+    if issubclass(sender, DynamicFormQuestion):
+        bump_schema_version(instance.object_id)
+    elif issubclass(sender, (DynamicMultipleChoiceAnswer,
+            DynamicRatingAnswer)):
+        DynamicForm.objects.filter(pk__in=DynamicFormQuestion.objects
+            .filter(pk=instance.question_id).values('object_id')).update(
+                schema_version=F('schema_version') + 1)
 
 
-register_admin()
+def connect_invalidate_schema(sender, **kwargs):
+    """
+    Connect ``invalidate_schema`` to the saves and deletes of ``sender`` and
+    its subclasses, if it is a question or a choice model. Subclasses
+    defined later, such as custom question types, are connected as their
+    classes are prepared.
+    """
+    if not issubclass(sender, (DynamicFormQuestion,
+            DynamicMultipleChoiceAnswer, DynamicRatingAnswer)):
+        return
+    post_save.connect(invalidate_schema, sender=sender,
+            dispatch_uid='dynamicforms-schema-save')
+    post_delete.connect(invalidate_schema, sender=sender,
+            dispatch_uid='dynamicforms-schema-delete')
+    for subclass in sender.__subclasses__():
+        connect_invalidate_schema(subclass)
+
+
+for model in (DynamicFormQuestion, DynamicMultipleChoiceAnswer,
+        DynamicRatingAnswer):
+    connect_invalidate_schema(model)
+class_prepared.connect(connect_invalidate_schema,
+        dispatch_uid='dynamicforms-schema-models')
@@ -0,0 +1,211 @@
+"""
+Write-behind storage of submissions.
+
+With queueing enabled, ``DynamicFormCreator`` validates a submission and
+only stores its cleaned data as a ``DynamicSubmission`` row with
+``enqueue``. ``process_pending``, run by the ``process_submissions``
+command, later turns batches of them into response sets and responses using
+bulk inserts.
+
+A batch is claimed, written and marked as processed in a single
+transaction, so a worker that dies mid-batch leaves it pending for the next
+run, and a batch claimed by another worker is skipped. Each submission is
+turned into responses inside its own savepoint: one that raises is rolled
+back and released with its error and attempt count, and the rest of the
+batch is written. The responses of the batch are then written in bulk,
+inside another savepoint; if that fails, they are written again one
+submission at a time, so only the submission at fault is released. After
+``DYNAMICFORMS_SUBMISSION_ATTEMPTS`` failures a submission is no longer
+retried.
+"""
+import traceback
+from datetime import datetime
+from uuid import uuid4
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import F
+
+import models
+from signals import answers_dropped
+from utils import atomic
+
+
+BATCH_SIZE = 100
+
+
+def enqueue(creator):
+    """
+    Store the cleaned data of a ``DynamicFormCreator``'s valid form as a
+    pending ``DynamicSubmission`` and return it.
+    """
+    return models.DynamicSubmission.objects.create(
+        token=uuid4().hex,
+        dynamic_form=creator.dynamicform,
+        user=creator.user,
+        interviewer=creator.request.user,
+        force_new_set=creator.force_new_set,
+        form_version=creator.version,
+        payload=json.dumps(creator.form.cleaned_data, cls=DjangoJSONEncoder))
+
+
+def get_status(token):
+    """
+    Return ``'pending'``, ``'processed'``, ``'failed'`` or ``None`` for an
+    unknown token.
+    """
+    try:
+        submission = models.DynamicSubmission.objects.get(token=token)
+    except models.DynamicSubmission.DoesNotExist:
+        return None
+    if submission.processed is not None:
+        return 'processed'
+    return 'pending' if submission.is_pending else 'failed'
+
+
+def process_pending(batch_size=BATCH_SIZE):
+    """
+    Write up to ``batch_size`` pending submissions, oldest first. Return the
+    number of submissions written; failed ones aren't counted.
+
+    On backends without savepoints, such as SQLite with this version of
+    Django, a failed submission may leave an empty response set or some of
+    its responses behind, and the responses of a batch are written one
+    submission at a time.
+    """
+    token = uuid4().hex
+    with atomic():
+        pending = models.DynamicSubmission.objects.pending().filter(worker='')
+        ids = list(pending.order_by('pk')
+            .values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return 0
+        pending.filter(pk__in=ids).update(worker=token)
+        submissions = list(models.DynamicSubmission.objects
+            .filter(worker=token, processed__isnull=True)
+            .select_related('dynamic_form', 'user', 'interviewer',
+                'form_version')
+            .order_by('pk'))
+
+        questions = {}
+        built = []
+        for submission in submissions:
+            dynamicform = submission.dynamic_form
+            if dynamicform.pk not in questions:
+                questions[dynamicform.pk] = dict([(q.get_form_name(), q)
+                    for q in dynamicform.get_questions()])
+            sid = transaction.savepoint()
+            try:
+                response_set, rows, values = _build_responses(submission,
+                    questions[dynamicform.pk])
+            except Exception:
+                transaction.savepoint_rollback(sid)
+                _release_failed(submission)
+                continue
+            transaction.savepoint_commit(sid)
+            built.append((submission, response_set, rows, values))
+
+        written = []
+        if connection.features.uses_savepoints and len(built) > 1:
+            sid = transaction.savepoint()
+            try:
+                _write_responses(built)
+            except Exception:
+                transaction.savepoint_rollback(sid)
+            else:
+                transaction.savepoint_commit(sid)
+                written = built
+        if not written:
+            for item in built:
+                sid = transaction.savepoint()
+                try:
+                    _write_responses([item])
+                except Exception:
+                    transaction.savepoint_rollback(sid)
+                    _release_failed(item[0])
+                    continue
+                transaction.savepoint_commit(sid)
+                written.append(item)
+    for submission, response_set, rows, values in written:
+        if values:
+            answers_dropped.send(sender=models.DynamicSubmission,
+                dynamicform_id=submission.dynamic_form_id,
+                form_version_id=submission.form_version_id,
+                response_set_id=response_set.pk, values=values)
+    return len(written)
+
+
+def _write_responses(built):
+    """
+    Save the responses of ``(submission, response_set, rows, dropped)``
+    tuples, update the tallies and latest response sets of their forms and
+    mark the submissions as processed.
+    """
+    responses = []
+    tallied = {}
+    latest = {}
+    for submission, response_set, rows, values in built:
+        dynamicform = submission.dynamic_form
+        key = (submission.user, dynamicform)
+        latest[key] = (response_set, latest.get(key, (None, 0))[1] + 1)
+        responses.extend(rows)
+        tallied.setdefault(dynamicform, []).extend(rows)
+    models.save_responses(responses)
+    for dynamicform, objs in tallied.items():
+        models.increment_tallies(dynamicform, objs)
+    for (user, dynamicform), (response_set, n) in latest.items():
+        models.record_submissions(user, dynamicform, response_set, n)
+    now = datetime.utcnow()
+    for submission, response_set, rows, values in built:
+        models.DynamicSubmission.objects.filter(pk=submission.pk) \
+            .update(processed=now, response_set=response_set.pk)
+
+
+def _release_failed(submission):
+    """
+    Release a submission that raised, recording the current exception and
+    counting the attempt.
+    """
+    models.DynamicSubmission.objects.filter(pk=submission.pk).update(
+        worker='', attempts=F('attempts') + 1, error=traceback.format_exc())
+
+
+def _build_responses(submission, questions):
+    """
+    Return ``(response_set, rows, dropped)`` for a submission: its response
+    set, its unsaved responses and the values whose question or choices no
+    longer exist. ``questions`` maps field names to resolved questions.
+    """
+    payload = json.loads(submission.payload)
+    response_set = _get_response_set(submission)
+    rows = []
+    dropped = {}
+    for name, value in payload.items():
+        question = questions.get(name)
+        if question is None:
+            # The question was deleted after the submission.
+            dropped[name] = value
+            continue
+        objs = question.build_responses(submission.user, value,
+            response_set)
+        if models.lost_choices(question, value, objs):
+            dropped[name] = value
+        rows.extend(objs)
+    return response_set, rows, dropped
+
+
+def _get_response_set(submission):
+    kwargs = {
+        'user': submission.user,
+        'dynamic_form': submission.dynamic_form,
+        'interviewer': submission.interviewer,
+        'form_version': submission.form_version,
+    }
+    if submission.force_new_set:
+        return models.DynamicResponseSet.objects.create(**kwargs)
+    return models.DynamicResponseSet.objects.upsert(**kwargs)[0]
@@ -0,0 +1,307 @@
+"""
+Compiled form schemas.
+
+Building a ``DynamicFormShell`` means resolving every question of a form and
+calling its ``display()`` method, which costs several queries per render.
+Forms rarely change, so the result can be compiled into a tuple of
+``FieldSpec``s and stored in Django's cache framework. The cache key contains
+the form's ``schema_version``, a column which is incremented in the same
+transaction as any change to a question or a choice of the form (see
+``models.invalidate_schema``). Every process therefore agrees on the current
+version, and stale schemas are simply never looked up again.
+
+Published form versions (``models.DynamicFormVersion``) never change, so
+their schemas are compiled from the version's snapshot and cached under the
+version for ``VERSION_CACHE_TIMEOUT``, without any invalidation.
+
+Page breaks are kept in a schema as specs without a ``field_class``, which
+``split_pages`` uses to cut paged forms and every other reader skips.
+"""
+from collections import namedtuple
+from copy import deepcopy
+from hashlib import md5
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+from django.conf import settings
+from django.core.cache import cache
+
+from utils import get_class
+
+
+SCHEMA_CACHE_TIMEOUT = getattr(settings, 'DYNAMICFORMS_SCHEMA_CACHE_TIMEOUT',
+        60 * 60 * 24)
+
+VERSION_CACHE_TIMEOUT = getattr(settings,
+        'DYNAMICFORMS_VERSION_CACHE_TIMEOUT', 60 * 60 * 24 * 30)
+
+SCHEMA_KEY = 'dynamicforms:schema:%d:%d'
+PUBLISHED_SCHEMA_KEY = 'dynamicforms:published-schema:%s'
+HTML_KEY = 'dynamicforms:html:%d:%s:%s'
+JSON_KEY = 'dynamicforms:json:%d:%s'
+
+# The parts of a field description served to clients as JSON
+PUBLIC_FIELD_KEYS = ('key', 'label', 'choices', 'options')
+
+# Field arguments kept in a spec's ``options`` when they differ from their
+# default, besides the widget's ``attrs``.
+FIELD_OPTIONS = ('required', 'help_text', 'initial', 'max_length',
+        'min_length', 'max_value', 'min_value')
+
+_SCALARS = (basestring, bool, int, long, float)
+
+
+class FieldSpec(namedtuple('FieldSpec',
+        'key field_class label widget choices options field')):
+    """
+    An immutable description of a single form field.
+
+        * ``key``         - name of the field in the form
+        * ``field_class`` - ``django.forms.Field`` subclass, or ``None`` for
+                            a page break
+        * ``label``       - label of the field
+        * ``widget``      - ``django.forms.Widget`` subclass
+        * ``choices``     - tuple of choices, or ``None``
+        * ``options``     - tuple of ``(name, value)`` pairs of the other
+                            arguments of the field listed in
+                            ``FIELD_OPTIONS``, and of its widget's ``attrs``
+        * ``field``       - the field instance the spec was taken from, or
+                            ``None`` when rebuilt from a snapshot
+
+    Specs compare by their description; ``field`` is left out.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def page_break(cls, key):
+        return cls(key, None, None, None, None, (), None)
+
+    @classmethod
+    def from_field(cls, key, field):
+        if field is None:
+            return cls.page_break(key)
+        choices = getattr(field, 'choices', None)
+        if choices is not None:
+            choices = tuple(tuple(c) for c in choices)
+        options = {}
+        for name in FIELD_OPTIONS:
+            value = getattr(field, name, None)
+            if name == 'help_text' and value:
+                value = unicode(value)
+            if isinstance(value, _SCALARS) and value != '' and \
+                    not (name == 'required' and value):
+                options[name] = value
+        attrs = dict([(k, v) for k, v in field.widget.attrs.items()
+            if isinstance(v, _SCALARS)])
+        if attrs:
+            options['attrs'] = attrs
+        return cls(key, type(field), field.label, type(field.widget), choices,
+            _freeze(options), field)
+
+    @classmethod
+    def from_dict(cls, d):
+        if d['field_class'] is None:
+            return cls.page_break(d['key'])
+        choices = d['choices']
+        if choices is not None:
+            choices = tuple(tuple(c) for c in choices)
+        return cls(d['key'], get_class(d['field_class']), d['label'],
+            get_class(d['widget']), choices, _freeze(d.get('options') or {}),
+            None)
+
+    def to_dict(self):
+        if self.is_page_break:
+            return {'key': self.key, 'field_class': None, 'label': None,
+                'widget': None, 'choices': None, 'options': {}}
+        options = dict(self.options)
+        if 'attrs' in options:
+            options['attrs'] = dict(options['attrs'])
+        return {
+            'key': self.key,
+            'field_class': _get_path(self.field_class),
+            'label': unicode(self.label),
+            'widget': _get_path(self.widget),
+            'choices': self.choices and [[k, unicode(v)]
+                for k, v in self.choices],
+            'options': options,
+        }
+
+    @property
+    def is_page_break(self):
+        return self.field_class is None
+
+    def __eq__(self, other):
+        return tuple(self[:-1]) == tuple(other[:-1])
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(tuple(self[:-1]))
+
+    def build(self):
+        """
+        Return a new form field instance for this spec: a copy of ``field``
+        if there is one, or a field built from the description.
+        """
+        if self.field is not None:
+            return deepcopy(self.field)
+        kwargs = dict(self.options)
+        attrs = dict(kwargs.pop('attrs', ()))
+        kwargs.update({'label': self.label,
+            'widget': self.widget(attrs=attrs or None)})
+        if self.choices is not None:
+            kwargs['choices'] = self.choices
+        return self.field_class(**kwargs)
+
+
+def _freeze(options):
+    items = []
+    for name, value in options.items():
+        if isinstance(value, dict):
+            value = tuple(sorted(value.items()))
+        items.append((name, value))
+    return tuple(sorted(items))
+
+
+def _get_path(cls):
+    return '%s.%s' % (cls.__module__, cls.__name__)
+
+
+def compile_schema(questions, user=None):
+    """
+    Turn a list of resolved questions into a tuple of ``FieldSpec``s.
+    """
+    specs = []
+    for question in questions:
+        field, key = question.display(user)
+        specs.append(FieldSpec.from_field(key, field))
+    return tuple(specs)
+
+
+def split_pages(form_schema, page_size=None, is_page_break=None):
+    """
+    Split a compiled schema into a list of pages, each a tuple of field
+    specs. Pages end at page breaks and, if ``page_size`` is given, after
+    every ``page_size`` fields. Page breaks themselves are dropped and empty
+    pages are skipped, but there is always at least one page.
+
+    Other sequences describing the questions of a form can be split the same
+    way by passing ``is_page_break``, which tells page breaks apart.
+    """
+    if is_page_break is None:
+        is_page_break = lambda spec: spec.is_page_break
+    pages = []
+    page = []
+    for spec in form_schema:
+        if is_page_break(spec):
+            if page:
+                pages.append(tuple(page))
+                page = []
+            continue
+        page.append(spec)
+        if page_size and len(page) >= page_size:
+            pages.append(tuple(page))
+            page = []
+    if page or not pages:
+        pages.append(tuple(page))
+    return pages
+
+
+def get_versioned_schema(dynamicform, get_questions=None):
+    """
+    Return ``(version, schema)`` for ``dynamicform`` at the
+    ``schema_version`` it was loaded with, compiling and caching the schema
+    if necessary. The cached fields must be picklable.
+
+    ``get_questions`` is called to load the resolved questions on a cache
+    miss; it defaults to ``dynamicform.get_questions``.
+    """
+    version = dynamicform.schema_version
+    key = SCHEMA_KEY % (dynamicform.pk, version)
+    schema = cache.get(key)
+    if schema is None:
+        get_questions = get_questions or dynamicform.get_questions
+        schema = compile_schema(get_questions())
+        cache.set(key, schema, SCHEMA_CACHE_TIMEOUT)
+    return version, schema
+
+
+def get_schema(dynamicform, get_questions=None):
+    """
+    Return the compiled schema of ``dynamicform``. See
+    ``get_versioned_schema``.
+    """
+    return get_versioned_schema(dynamicform, get_questions)[1]
+
+
+def take_snapshot(questions):
+    """
+    Describe a list of resolved questions as a JSON-serialisable list, from
+    which ``get_published_schema`` rebuilds their fields.
+    """
+    snapshot = []
+    for question in questions:
+        field, key = question.display(None)
+        snapshot.append({
+            'id': question.pk,
+            'type': question._meta.module_name,
+            'question_text': question.question_text,
+            'order': question.order,
+            'field': FieldSpec.from_field(key, field).to_dict(),
+        })
+    return snapshot
+
+
+def get_published_schema(version):
+    """
+    Return the compiled schema of a ``DynamicFormVersion``.
+    """
+    key = PUBLISHED_SCHEMA_KEY % version.cache_key
+    schema = cache.get(key)
+    if schema is None:
+        schema = tuple([FieldSpec.from_dict(q['field'])
+            for q in version.get_snapshot()])
+        cache.set(key, schema, VERSION_CACHE_TIMEOUT)
+    return schema
+
+
+def get_html(dynamicform_id, version, variant, render,
+        timeout=SCHEMA_CACHE_TIMEOUT):
+    """
+    Return the HTML of a form at a given schema version, calling ``render``
+    and caching its result on a miss. ``variant`` tells apart different
+    renderings of the same form.
+    """
+    key = HTML_KEY % (dynamicform_id, version, md5(variant.encode('utf-8')).hexdigest())
+    html = cache.get(key)
+    if html is None:
+        html = unicode(render())
+        cache.set(key, html, timeout)
+    return html
+
+
+def get_json(dynamicform_id, version, get_snapshot,
+        timeout=SCHEMA_CACHE_TIMEOUT):
+    """
+    Return the questions of a form at a given schema version as JSON,
+    calling ``get_snapshot`` for the list described by ``take_snapshot`` and
+    caching the result on a miss. Questions are identified by the slug of
+    their type; the Python paths of their field and widget classes are left
+    out.
+    """
+    key = JSON_KEY % (dynamicform_id, version)
+    data = cache.get(key)
+    if data is None:
+        data = json.dumps({'id': dynamicform_id, 'version': version,
+            'questions': [_public_question(q) for q in get_snapshot()]})
+        cache.set(key, data, timeout)
+    return data
+
+
+def _public_question(question):
+    field = question['field']
+    return dict(question, field=dict([(name, field[name])
+        for name in PUBLIC_FIELD_KEYS]))
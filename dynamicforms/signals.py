@@ -0,0 +1,116 @@
+"""
+Instrumentation of ``DynamicFormCreator`` and of submissions.
+
+``phase_finished`` is sent after each phase of handling a form:
+``populate_form``, ``validate`` and ``save_data``. Receivers get the phase
+name, its duration in seconds, the number of queries it ran on all database
+connections, the form id, the number of questions and the response set id
+(``None`` until one exists). When no receiver is connected nothing is
+measured.
+
+``answers_dropped`` is sent when submitted answers can't be saved because
+their question, or one of the choices they picked, was deleted since the
+form was shown; typically answers to a published version whose draft has
+changed. Receivers get the form id, the version id, the response set id and
+the dropped ``values``, a dict of submitted values keyed by field name.
+
+``MetricsCollector`` is a receiver that keeps the measurements in memory,
+for tests or to feed an exporter.
+"""
+import time
+
+from django.db import connections
+from django.dispatch import Signal
+
+
+phase_finished = Signal(providing_args=['phase', 'duration', 'queries',
+    'dynamicform_id', 'question_count', 'response_set_id'])
+
+answers_dropped = Signal(providing_args=['dynamicform_id', 'form_version_id',
+    'response_set_id', 'values'])
+
+
+class _NoMeasure(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_MEASURE = _NoMeasure()
+
+
+class _Measure(object):
+
+    def __init__(self, creator, phase):
+        self.creator = creator
+        self.phase = phase
+
+    def __enter__(self):
+        self.connections = []
+        for connection in connections.all():
+            self.connections.append((connection,
+                connection.use_debug_cursor, len(connection.queries)))
+            connection.use_debug_cursor = True
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = time.time() - self.start
+        queries = 0
+        for connection, use_debug_cursor, start in self.connections:
+            queries += len(connection.queries) - start
+            connection.use_debug_cursor = use_debug_cursor
+            if not use_debug_cursor:
+                # Don't keep the queries logged on our behalf.
+                del connection.queries[start:]
+        if exc_type is None:
+            creator = self.creator
+            response_set = creator.response_set
+            phase_finished.send(sender=type(creator), phase=self.phase,
+                duration=duration, queries=queries,
+                dynamicform_id=creator.dynamicform.pk,
+                question_count=len(creator.form.fields),
+                response_set_id=response_set.pk if response_set else None)
+        return False
+
+
+def measure_phase(creator, phase):
+    """
+    Return a context manager timing ``phase`` of ``creator`` and sending
+    ``phase_finished`` at the end, or one doing nothing when there are no
+    receivers.
+    """
+    if not phase_finished.receivers:
+        return _NO_MEASURE
+    return _Measure(creator, phase)
+
+
+class MetricsCollector(object):
+    """
+    Collects ``phase_finished`` measurements as a list of dicts::
+
+        collector = MetricsCollector().connect()
+        ...
+        collector.disconnect()
+        collector.measurements
+    """
+
+    def __init__(self):
+        self.measurements = []
+
+    def __call__(self, sender, **kwargs):
+        kwargs.pop('signal', None)
+        self.measurements.append(kwargs)
+
+    def connect(self):
+        phase_finished.connect(self, weak=False)
+        return self
+
+    def disconnect(self):
+        phase_finished.disconnect(self)
+
+    def get_phase(self, phase):
+        return [m for m in self.measurements if m['phase'] == phase]
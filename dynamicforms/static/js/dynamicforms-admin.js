@@ -35,10 +35,22 @@
       delay: 300,
       handle: '.drag_handle',
       update: function() {
-        $('#add_content_functionality').hide();
-        if (!changed)
-          alert("The form's content order will be updated when you save. To discard changes in order, refresh page.");
-        changed = true;
+        var data = $("#sortable").sortable('serialize') +
+          '&csrfmiddlewaretoken=' +
+          $('input[name=csrfmiddlewaretoken]').first().val();
+        $.ajax({
+          type: 'POST',
+          url: 'reorder/',
+          data: data,
+          dataType: 'json',
+          error: function() {
+            // Fall back to saving the order with the form.
+            $('#add_content_functionality').hide();
+            if (!changed)
+              alert("The form's content order will be updated when you save. To discard changes in order, refresh page.");
+            changed = true;
+          }
+        });
       }
     });
 
@@ -0,0 +1,18 @@
+from django import template
+
+
+register = template.Library()
+
+
+@register.simple_tag
+def cached_form(form, method='as_p'):
+    """
+    Render a ``DynamicFormShell`` through its HTML cache::
+
+        {% load dynamicforms_tags %}
+        {% cached_form form "as_table" %}
+
+    Keep ``{% csrf_token %}`` and anything else specific to the visitor
+    outside of the tag.
+    """
+    return form.render_cached(method)
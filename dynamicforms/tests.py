@@ -1,8 +1,24 @@
 from django.contrib.auth.models import User
 from django.test.client import RequestFactory
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.utils import unittest
 from models import *
 from forms import *
+import forms
+import models
+import schema
+
+
+class LegacyTextQuestion(DynamicTextQuestion):
+    """
+    A text question that stores its answers with ``save_response`` only.
+    """
+    saved = []
+
+    @classmethod
+    def save_response(cls, user, question_id, response, response_set):
+        cls.saved.append((question_id, response, response_set))
 
 
 class BaseTestCase(TestCase):
@@ -60,3 +76,1116 @@ class ModelTests(BaseTestCase):
         self.assertStringIn('input', form, 3)
         self.assertStringIn('What time is it?', form)
         self.assertStringIn('Are you crazy?', form)
+
+    def test_bulk_resolving(self):
+        df = DynamicForm.objects.create(name='Interview')
+        for i in range(3):
+            DynamicTextQuestion.objects.create(
+                question_text='Text %d' % i, parent_object=df, order=3 - i)
+            DynamicYesNoQuestion.objects.create(
+                question_text='Yes/No %d' % i, parent_object=df, order=3 - i)
+
+        expected = [q.pk for q in df.questions.all()]
+        # One query for the rows, and one per question type.
+        with self.assertNumQueries(3):
+            questions = df.questions.all().resolve()
+
+        self.assertEqual(expected, [q.pk for q in questions])
+        self.assertEqual(
+            [DynamicTextQuestion, DynamicYesNoQuestion] * 3,
+            [type(q) for q in questions])
+
+    def test_prefetch_choices(self):
+        df = DynamicForm.objects.create(name='Interview')
+        for i in range(3):
+            q = DynamicRatingQuestion.objects.create(
+                question_text='Rate %d' % i, parent_object=df)
+            for j in range(5):
+                DynamicRatingAnswer.objects.create(question=q,
+                    answer_text='%d' % j)
+            q = DynamicMultipleChoiceQuestion.objects.create(
+                question_text='Pick %d' % i, parent_object=df)
+            DynamicMultipleChoiceAnswer.objects.create(question=q,
+                answer_text='Red')
+        DynamicYesNoQuestion.objects.create(
+            question_text='Yes?', parent_object=df)
+
+        df.get_questions()
+        # Rows, one query per question type and one per answer model.
+        with self.assertNumQueries(6):
+            questions = df.get_questions()
+            choices = [q.get_choices() for q in questions
+                if not isinstance(q, DynamicYesNoQuestion)]
+        self.assertEqual([5, 1] * 3, [len(c) for c in choices])
+        self.assertEqual('dynamic-rating-answer-%d' %
+            questions[0].dynamicratinganswer_set.all()[0].pk,
+            choices[0][0][0])
+
+    def test_bulk_save(self):
+        df = DynamicForm.objects.create(name='Interview')
+        texts = [DynamicTextQuestion.objects.create(
+            question_text='Text %d' % i, parent_object=df) for i in range(5)]
+        yesno = DynamicYesNoQuestion.objects.create(
+            question_text='Yes?', parent_object=df)
+        rating = DynamicRatingQuestion.objects.create(
+            question_text='Rate', parent_object=df)
+        answer = DynamicRatingAnswer.objects.create(question=rating,
+            answer_text='5')
+        data = {yesno.get_form_name(): 'yes',
+            rating.get_form_name(): 'dynamic-rating-answer-%d' % answer.pk}
+        for q in texts:
+            data[q.get_form_name()] = 'Answer %d' % q.pk
+
+        request = self.factory.post('/', data)
+        request.user = self.user
+        f = DynamicFormCreator(request, df.id)
+        self.assertTrue(f.is_success())
+
+        response_set = DynamicResponseSet.objects.get()
+        self.assertEqual(5, response_set.dynamictextresponse_set.count())
+        self.assertTrue(response_set.dynamicyesnoresponse_set.get().response)
+        self.assertEqual(answer,
+            response_set.dynamicratingresponse_set.get().response)
+
+        # The number of queries doesn't depend on the number of questions.
+        for i in range(5, 10):
+            q = DynamicTextQuestion.objects.create(
+                question_text='Text %d' % i, parent_object=df)
+            data[q.get_form_name()] = 'Answer %d' % q.pk
+        request = self.factory.post('/', data)
+        request.user = self.user
+        # Loading the form and its questions, creating the response set, one
+        # INSERT per response model, updating the answer tallies and the
+        # latest response set.
+        with self.assertNumQueries(13):
+            DynamicFormCreator(request, df.id, force_new_set=True)
+
+    def test_multiple_choice_save_response(self):
+        df = DynamicForm.objects.create(name='Interview')
+        q = DynamicMultipleChoiceQuestion.objects.create(
+            question_text='Pick some', parent_object=df)
+        other = DynamicMultipleChoiceQuestion.objects.create(
+            question_text='Pick more', parent_object=df)
+        answers = [DynamicMultipleChoiceAnswer.objects.create(question=q,
+            answer_text='%d' % i) for i in range(3)]
+        foreign = DynamicMultipleChoiceAnswer.objects.create(question=other,
+            answer_text='Foreign')
+        response_set = DynamicResponseSet.objects.create(user=self.user,
+            dynamic_form=df)
+
+        selected = ['dynamic-multiple-choice-answer-%d' % a.pk
+            for a in answers + [foreign]]
+        # The question, its selected answers and one INSERT.
+        with self.assertNumQueries(3):
+            DynamicMultipleChoiceQuestion.save_response(self.user, q.pk,
+                selected, response_set)
+        self.assertEqual(set(answers), set([r.answer for r in
+            response_set.dynamicmultiplechoiceresponse_set.all()]))
+
+    def test_save_response_override(self):
+        df = DynamicForm.objects.create(name='Interview')
+        q = LegacyTextQuestion.objects.create(question_text='Why?',
+            parent_object=df)
+        self.assertTrue(LegacyTextQuestion.overrides_save_response())
+        self.assertFalse(DynamicTextQuestion.overrides_save_response())
+        request = self.factory.post('/', {q.get_form_name(): 'Because'})
+        request.user = self.user
+        LegacyTextQuestion.saved = []
+        creator = DynamicFormCreator(request, df.id, force_new_set=True)
+        self.assertTrue(creator.is_success())
+        self.assertEqual([(q.pk, 'Because', creator.response_set)],
+            LegacyTextQuestion.saved)
+        self.assertFalse(DynamicTextResponse.objects.exists())
+
+    def test_response_records(self):
+        df = DynamicForm.objects.create(name='Interview')
+        yesno = DynamicYesNoQuestion.objects.create(
+            question_text='Yes?', parent_object=df, order=2)
+        text = DynamicTextQuestion.objects.create(
+            question_text='Why?', parent_object=df, order=1)
+        mc = DynamicMultipleChoiceQuestion.objects.create(
+            question_text='Pick', parent_object=df, order=3)
+        red = DynamicMultipleChoiceAnswer.objects.create(question=mc,
+            answer_text='Red')
+        sets = []
+        for i in range(3):
+            rs = DynamicResponseSet.objects.create(user=self.user,
+                dynamic_form=df)
+            DynamicMultipleChoiceResponse.objects.create(user=self.user,
+                question=mc, answer=red, dynamic_response_set=rs)
+            DynamicYesNoResponse.objects.create(user=self.user,
+                question=yesno, response=True, dynamic_response_set=rs)
+            DynamicTextResponse.objects.create(user=self.user,
+                question=text, text_response='No', dynamic_response_set=rs)
+            sets.append(rs)
+
+        # One per response model and one for the documents.
+        with self.assertNumQueries(len(RESPONSE_MODELS) + 1):
+            records = get_records(sets)
+        self.assertEqual(3, len(records))
+        self.assertEqual([
+            (text.pk, 'Why?', 'dynamictextquestion', 'No'),
+            (yesno.pk, 'Yes?', 'dynamicyesnoquestion', 'Yes'),
+            (mc.pk, 'Pick', 'dynamicmultiplechoicequestion', 'Red'),
+        ], [r[1:] for r in records[sets[0].pk]])
+
+    def test_export(self):
+        import export
+        df = DynamicForm.objects.create(name='Interview')
+        text = DynamicTextQuestion.objects.create(
+            question_text='Why?', parent_object=df, order=2)
+        mc = DynamicMultipleChoiceQuestion.objects.create(
+            question_text='Pick', parent_object=df, order=1)
+        answers = [DynamicMultipleChoiceAnswer.objects.create(question=mc,
+            answer_text=t) for t in ('Red', 'Blue')]
+        DynamicPageBreak.objects.create(question_text='Next',
+            parent_object=df, order=3)
+        for i in range(5):
+            rs = DynamicResponseSet.objects.create(user=self.user,
+                dynamic_form=df)
+            DynamicTextResponse.objects.create(user=self.user,
+                question=text, text_response=u'Caf\xe9 %d' % i,
+                dynamic_response_set=rs)
+            for a in answers:
+                DynamicMultipleChoiceResponse.objects.create(user=self.user,
+                    question=mc, answer=a, dynamic_response_set=rs)
+
+        lines = list(export.iter_csv(df, chunk_size=2))
+        self.assertEqual(6, len(lines))
+        self.assertEqual('response_set,user,interviewer,added,Pick,Why?',
+            lines[0].strip())
+        self.assertTrue(lines[1].strip().endswith(
+            'Red; Blue,Caf\xc3\xa9 0'))
+        self.assertEqual(5, len(list(export.iter_jsonl(df))))
+
+    def test_tallies(self):
+        df = DynamicForm.objects.create(name='Interview')
+        yesno = DynamicYesNoQuestion.objects.create(
+            question_text='Yes?', parent_object=df)
+        mc = DynamicMultipleChoiceQuestion.objects.create(
+            question_text='Pick', parent_object=df)
+        red, blue = [DynamicMultipleChoiceAnswer.objects.create(question=mc,
+            answer_text=t) for t in ('Red', 'Blue')]
+        red_key = 'dynamic-multiple-choice-answer-%d' % red.pk
+        blue_key = 'dynamic-multiple-choice-answer-%d' % blue.pk
+        for value, picked in (('yes', [red_key, blue_key]), ('no', [red_key]),
+                ('yes', [red_key])):
+            request = self.factory.post('/', {yesno.get_form_name(): value,
+                mc.get_form_name(): picked})
+            request.user = self.user
+            DynamicFormCreator(request, df.id, force_new_set=True)
+
+        expected = {
+            yesno.pk: {'yes': 2, 'no': 1},
+            mc.pk: {red_key: 3, blue_key: 1},
+        }
+        with self.assertNumQueries(1):
+            self.assertEqual(expected, df.get_tallies())
+
+        DynamicAnswerTally.objects.update(count=0)
+        self.assertEqual(4, rebuild_tallies(df))
+        self.assertEqual(expected, df.get_tallies())
+
+    def test_reorder_questions(self):
+        df = DynamicForm.objects.create(name='Interview')
+        questions = [DynamicTextQuestion.objects.create(
+            question_text='Text %d' % i, parent_object=df) for i in range(4)]
+        order = [q.pk for q in reversed(questions)]
+        # Checking the ids, a single UPDATE and bumping the schema version.
+        with self.assertNumQueries(3):
+            df.reorder_questions(order)
+        self.assertEqual(order, [q.pk for q in df.questions.all()])
+        self.assertRaises(ValueError, df.reorder_questions, order[1:])
+
+        self.user.is_staff = self.user.is_superuser = True
+        self.user.save()
+        self.client.login(username='test', password='test')
+        url = '/admin/dynamicforms/dynamicform/%d/reorder/' % df.pk
+        response = self.client.post(url, {'contentorder[]': order[::-1]})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(order[::-1], [q.pk for q in df.questions.all()])
+        response = self.client.post(url, {'contentorder[]': order[1:]})
+        self.assertEqual(400, response.status_code)
+
+    def test_delete_questions(self):
+        df = DynamicForm.objects.create(name='Interview')
+        other = DynamicForm.objects.create(name='Other')
+        keep = DynamicTextQuestion.objects.create(
+            question_text='Keep', parent_object=df)
+        foreign = DynamicTextQuestion.objects.create(
+            question_text='Foreign', parent_object=other)
+        yesno = DynamicYesNoQuestion.objects.create(
+            question_text='Yes?', parent_object=df)
+        rating = DynamicRatingQuestion.objects.create(
+            question_text='Rate', parent_object=df)
+        answer = DynamicRatingAnswer.objects.create(question=rating,
+            answer_text='5')
+        request = self.factory.post('/', {keep.get_form_name(): 'Text',
+            yesno.get_form_name(): 'yes',
+            rating.get_form_name(): 'dynamic-rating-answer-%d' % answer.pk})
+        request.user = self.user
+        DynamicFormCreator(request, df.id)
+
+        n = df.delete_questions([yesno.pk, rating.pk, foreign.pk])
+        self.assertEqual(2, n)
+        self.assertEqual([keep.pk], [q.pk for q in df.questions.all()])
+        self.assertEqual(1, other.questions.count())
+        for model in (DynamicYesNoQuestion, DynamicRatingQuestion,
+                DynamicMultipleChoiceQuestion, DynamicRatingAnswer,
+                DynamicYesNoResponse, DynamicRatingResponse,
+                DynamicAnswerTally):
+            self.assertEqual(0, model.objects.count())
+        self.assertEqual(1, DynamicTextResponse.objects.count())
+
+    def test_question_type_registry(self):
+        df = DynamicForm.objects.create(name='Interview')
+        DynamicTextQuestion.objects.create(question_text='Warm up',
+            parent_object=df)
+        entry = QUESTION_TYPES.get_by_slug('dynamicyesnoquestion')
+        self.assertEqual(DynamicYesNoQuestion, entry['class'])
+        self.assertEqual(entry, QUESTION_TYPES.get_by_class(
+            DynamicYesNoQuestion))
+
+        # Django's INSERT per table and its check for the middle one, and
+        # bumping the schema version; the content type comes from the
+        # registry.
+        with self.assertNumQueries(5):
+            q = DynamicYesNoQuestion.objects.create(question_text='Yes?',
+                parent_object=df)
+        base = DynamicFormQuestion.objects.get(pk=q.pk)
+        with self.assertNumQueries(1):
+            self.assertTrue(isinstance(base.resolve(), DynamicYesNoQuestion))
+
+    def test_import_budget(self):
+        """
+        Importing the models has no side effects: no queries, no admin
+        registration and no question type registration.
+        """
+        import os
+        import subprocess
+        import sys
+        script = '\n'.join([
+            'import sys, time',
+            'from django.conf import settings',
+            'settings.DEBUG = True',
+            'import django.contrib.auth.models',
+            'import django.contrib.contenttypes.generic',
+            'import django.core.cache',
+            'from django.db import connection',
+            'start = time.time()',
+            'import dynamicforms.models as m',
+            'print time.time() - start, len(connection.queries), \\',
+            '    "dynamicforms.admin" in sys.modules, \\',
+            '    m.QUESTION_TYPES._types is None',
+        ])
+        from django.conf import settings
+        # manage.py takes the project's parent directory off sys.path once
+        # the settings are imported; the subprocess needs it back.
+        name = settings.SETTINGS_MODULE
+        root = os.path.dirname(os.path.abspath(sys.modules[name].__file__))
+        for i in range(name.count('.')):
+            root = os.path.dirname(root)
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=name,
+            PYTHONPATH=os.pathsep.join(sys.path + [root]))
+        process = subprocess.Popen([sys.executable, '-c', script], env=env,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        output, errors = process.communicate()
+        self.assertEqual((0, ''), (process.returncode, errors))
+        elapsed, queries, admin, lazy = output.split()
+        # Only a gross regression, such as work done at import, should fail
+        # this on a loaded machine.
+        self.assertTrue(float(elapsed) < 5, elapsed)
+        self.assertEqual(('0', 'False', 'True'), (queries, admin, lazy))
+
+    def test_benchmark(self):
+        import benchmark
+        counts = dict([(t, 1) for t in benchmark.DEFAULT_COUNTS])
+        results = benchmark.run(counts, choices=2, repeat=1)
+        self.assertEqual(set(['render', 'render_uncached', 'validate',
+            'submit', 'responses', 'records', 'admin_change_view']),
+            set(results))
+        self.assertEqual([], benchmark.compare(results, results))
+        self.assertTrue(results['render']['queries'] <
+            results['render_uncached']['queries'])
+
+        baseline = {'submit': dict(results['submit'])}
+        baseline['submit']['queries'] -= 1
+        self.assertEqual([('submit', 'queries',
+            results['submit']['queries'] - 1, results['submit']['queries'])],
+            benchmark.compare(results, baseline))
+
+        # The memory of a benchmark doesn't depend on a bigger one run
+        # before it.
+        def allocate(size):
+            return lambda: len('x' * (size * 1024 * 1024))
+        benchmark.measure(allocate(8), repeat=1)
+        self.assertTrue(benchmark.measure(allocate(2),
+            repeat=1)['memory'] > 1024)
+
+    def test_phase_signals(self):
+        from signals import MetricsCollector
+        df = DynamicForm.objects.create(name='Interview')
+        q = DynamicTextQuestion.objects.create(
+            question_text='Why?', parent_object=df)
+        request = self.factory.post('/', {q.get_form_name(): 'Because'})
+        request.user = self.user
+
+        collector = MetricsCollector().connect()
+        try:
+            f = DynamicFormCreator(request, df.id)
+        finally:
+            collector.disconnect()
+        self.assertEqual(['populate_form', 'validate', 'save_data'],
+            [m['phase'] for m in collector.measurements])
+        saved = collector.get_phase('save_data')[0]
+        self.assertEqual(f.response_set.pk, saved['response_set_id'])
+        self.assertEqual(df.pk, saved['dynamicform_id'])
+        self.assertEqual(1, saved['question_count'])
+        self.assertEqual(0, collector.get_phase('validate')[0]['queries'])
+        self.assertTrue(saved['queries'] > 0)
+
+        DynamicFormCreator(request, df.id)
+        self.assertEqual(3, len(collector.measurements))
+
+    def test_queued_submissions(self):
+        import outbox
+        df = DynamicForm.objects.create(name='Interview')
+        q = DynamicTextQuestion.objects.create(
+            question_text='Why?', parent_object=df)
+        mc = DynamicMultipleChoiceQuestion.objects.create(
+            question_text='Pick some', parent_object=df)
+        red = DynamicMultipleChoiceAnswer.objects.create(
+            question=mc, answer_text='Red')
+        request = self.factory.post('/', {q.get_form_name(): 'Because',
+            mc.get_form_name(): 'dynamic-multiple-choice-answer-%d' % red.pk})
+        request.user = self.user
+
+        f = DynamicFormCreator(request, df.id, queue=True, force_new_set=True)
+        self.assertTrue(f.is_success())
+        self.assertEqual(None, f.response_set)
+        self.assertEqual('pending', outbox.get_status(f.submission.token))
+        self.assertEqual(None, outbox.get_status('unknown'))
+        DynamicFormCreator(request, df.id, queue=True, force_new_set=True)
+        self.assertEqual(2, DynamicSubmission.objects.pending().count())
+        self.assertEqual(0, DynamicResponseSet.objects.count())
+
+        self.assertEqual(1, outbox.process_pending(batch_size=1))
+        self.assertEqual(1, outbox.process_pending())
+        self.assertEqual(0, outbox.process_pending())
+        self.assertEqual('processed', outbox.get_status(f.submission.token))
+        submission = DynamicSubmission.objects.get(pk=f.submission.pk)
+        self.assertEqual([u'Because'], [r.text_response for r in
+            DynamicTextResponse.objects.filter(
+                dynamic_response_set=submission.response_set)])
+        self.assertEqual(2, DynamicResponseSet.objects.count())
+        self.assertEqual({'dynamic-multiple-choice-answer-%d' % red.pk: 2},
+            df.get_tallies()[mc.pk])
+
+        # A batch claimed by another worker is left alone.
+        DynamicFormCreator(request, df.id, queue=True)
+        DynamicSubmission.objects.pending().update(worker='other')
+        self.assertEqual(0, outbox.process_pending())
+        DynamicSubmission.objects.pending().update(worker='')
+
+        # A submission that can't be written doesn't hold up the others.
+        bad = DynamicSubmission.objects.create(token='bad', dynamic_form=df,
+            user=self.user, payload='{"%s": 5}' % mc.get_form_name())
+        DynamicFormCreator(request, df.id, queue=True)
+        self.assertEqual(2, outbox.process_pending())
+        bad = DynamicSubmission.objects.get(pk=bad.pk)
+        self.assertEqual((1, 'pending'), (bad.attempts,
+            outbox.get_status('bad')))
+        self.assertTrue('TypeError' in bad.error)
+        for i in range(models.SUBMISSION_ATTEMPTS - 1):
+            self.assertEqual(0, outbox.process_pending())
+        self.assertEqual('failed', outbox.get_status('bad'))
+        self.assertEqual([bad], list(DynamicSubmission.objects.failed()))
+        self.assertEqual(0, DynamicSubmission.objects.pending().count())
+
+        # So doesn't one whose responses fail to be written.
+        other = User.objects.create_user('other', 'other@test.com', 'other')
+        for user in (other, self.user):
+            DynamicFormCreator(request, df.id, user=user, queue=True)
+        record_submissions = models.record_submissions
+
+        def failing_record_submissions(user, *args):
+            if user == other:
+                raise ValueError('Cannot record')
+            return record_submissions(user, *args)
+        models.record_submissions = failing_record_submissions
+        try:
+            self.assertEqual(1, outbox.process_pending())
+        finally:
+            models.record_submissions = record_submissions
+        failed = DynamicSubmission.objects.get(user=other)
+        self.assertEqual((1, 'pending', None), (failed.attempts,
+            outbox.get_status(failed.token), failed.response_set))
+        self.assertTrue('Cannot record' in failed.error)
+        self.assertEqual(1, outbox.process_pending())
+        self.assertEqual('processed', outbox.get_status(failed.token))
+
+    def test_document_storage(self):
+        import export
+        df = DynamicForm.objects.create(name='Interview')
+        text = DynamicTextQuestion.objects.create(
+            question_text='Why?', parent_object=df, order=1)
+        yesno = DynamicYesNoQuestion.objects.create(
+            question_text='Yes?', parent_object=df, order=2)
+        mc = DynamicMultipleChoiceQuestion.objects.create(
+            question_text='Pick', parent_object=df, order=3)
+        red, blue = [DynamicMultipleChoiceAnswer.objects.create(question=mc,
+            answer_text=t) for t in ('Red', 'Blue')]
+        rating = DynamicRatingQuestion.objects.create(
+            question_text='Rate', parent_object=df, order=4)
+        good = DynamicRatingAnswer.objects.create(question=rating,
+            answer_text='Good')
+        request = self.factory.post('/', {text.get_form_name(): 'Because',
+            yesno.get_form_name(): 'yes',
+            mc.get_form_name(): ['dynamic-multiple-choice-answer-%d' % red.pk,
+                'dynamic-multiple-choice-answer-%d' % blue.pk],
+            rating.get_form_name(): 'dynamic-rating-answer-%d' % good.pk})
+        request.user = self.user
+
+        storage = models.RESPONSE_STORAGE
+        models.RESPONSE_STORAGE = 'document'
+        try:
+            f = DynamicFormCreator(request, df.id)
+        finally:
+            models.RESPONSE_STORAGE = storage
+        response_set = DynamicResponseSet.objects.get(pk=f.response_set.pk)
+        for model in RESPONSE_MODELS:
+            self.assertEqual(0, model.objects.count())
+        self.assertEqual([u'Because', u'Yes', u'Red', u'Blue', u'Good'],
+            [unicode(r) for r in response_set.responses])
+        records = response_set.records
+        self.assertEqual([(text.pk, 'dynamictextquestion', u'Because'),
+            (yesno.pk, 'dynamicyesnoquestion', u'Yes'),
+            (mc.pk, 'dynamicmultiplechoicequestion', u'Red'),
+            (mc.pk, 'dynamicmultiplechoicequestion', u'Blue'),
+            (rating.pk, 'dynamicratingquestion', u'Good')],
+            [(r.question_id, r.type, r.value) for r in records])
+        lines = list(export.iter_csv(df))
+        self.assertTrue(lines[1].endswith(',Because,Yes,Red; Blue,Good\r\n'))
+
+        tallies = df.get_tallies()
+        self.assertEqual({'yes': 1}, tallies[yesno.pk])
+        DynamicAnswerTally.objects.all().delete()
+        self.assertEqual(4, rebuild_tallies(df))
+        self.assertEqual(tallies, df.get_tallies())
+
+        # Deleted choices are skipped.
+        good.delete()
+        self.assertEqual(4, len(response_set.responses))
+        good.save()
+
+        self.assertEqual(5, unpack_responses([response_set]))
+        response_set = DynamicResponseSet.objects.get(pk=response_set.pk)
+        self.assertEqual('', response_set.document)
+        self.assertEqual(2, DynamicMultipleChoiceResponse.objects.count())
+        self.assertEqual(records, response_set.records)
+
+        self.assertEqual(5, pack_responses([response_set]))
+        self.assertEqual(0, DynamicMultipleChoiceResponse.objects.count())
+        self.assertEqual(records, DynamicResponseSet.objects.get(
+            pk=response_set.pk).records)
+
+    def test_archive_response_sets(self):
+        import export
+        df = DynamicForm.objects.create(name='Interview')
+        text = DynamicTextQuestion.objects.create(
+            question_text='Why?', parent_object=df)
+        mc = DynamicMultipleChoiceQuestion.objects.create(
+            question_text='Pick', parent_object=df)
+        red = DynamicMultipleChoiceAnswer.objects.create(question=mc,
+            answer_text='Red')
+        request = self.factory.post('/', {text.get_form_name(): 'Because',
+            mc.get_form_name(): 'dynamic-multiple-choice-answer-%d' % red.pk})
+        request.user = self.user
+        sets = [DynamicFormCreator(request, df.id, force_new_set=True,
+            queue=False).response_set for i in range(3)]
+        records = get_records(sets)
+        lines = list(export.iter_csv(df))
+        tallies = df.get_tallies()
+
+        old = sets[:2]
+        # Reading the rows, inserting the archive and deleting the sets with
+        # their rows, detaching submissions and latest response sets.
+        with self.assertNumQueries(len(RESPONSE_MODELS) * 2 + 4):
+            self.assertEqual(2, archive_response_sets(old))
+        self.assertEqual([sets[2].pk], [s.pk for s in
+            DynamicResponseSet.objects.all()])
+        self.assertEqual(1, DynamicTextResponse.objects.count())
+        self.assertEqual(2, ArchivedResponseSet.objects.count())
+
+        self.assertEqual(records, get_records(sets))
+        self.assertEqual(records[old[0].pk],
+            ArchivedResponseSet.objects.get(pk=old[0].pk).records)
+        self.assertEqual(lines, list(export.iter_csv(df)))
+        self.assertEqual([sets[2].pk], [s.pk for s, values in
+            export.iter_response_sets(df, archived=False)])
+        rebuild_tallies(df)
+        self.assertEqual(tallies, df.get_tallies())
+
+    def test_response_set_upsert(self):
+        import utils
+        df = DynamicForm.objects.create(name='Interview')
+        rs, created = DynamicResponseSet.objects.upsert(self.user, df,
+            self.user)
+        self.assertTrue(created)
+        self.assertEqual((rs, False), DynamicResponseSet.objects.upsert(
+            self.user, df, self.user))
+        self.assertEqual(rs.pk, DynamicResponseSet.objects.get(
+            unique_key=rs.unique_key).pk)
+
+        # Losing the race: the key exists but wasn't seen by the first lookup.
+        for on_conflict in (True, False):
+            old = utils.supports_on_conflict
+            utils.supports_on_conflict = lambda connection: on_conflict
+            try:
+                other = DynamicResponseSet(user=self.user, dynamic_form=df,
+                    unique_key=rs.unique_key)
+                self.assertFalse(utils.insert_unless_exists(other,
+                    'unique_key'))
+                self.assertEqual(1, DynamicResponseSet.objects.count())
+                rs2, created = DynamicResponseSet.objects.upsert(self.user,
+                    df)
+                self.assertTrue(created)
+                self.assertTrue(rs2.pk)
+                rs2.delete()
+            finally:
+                utils.supports_on_conflict = old
+
+        legacy = [DynamicResponseSet.objects.create(user=self.user,
+            dynamic_form=df) for i in range(2)]
+        self.assertEqual(1, assign_unique_keys())
+        self.assertEqual(0, assign_unique_keys())
+        self.assertEqual((legacy[1], False),
+            DynamicResponseSet.objects.upsert(self.user, df))
+
+    def test_latest_response_sets(self):
+        forms = [DynamicForm.objects.create(name='Form %d' % i)
+            for i in range(3)]
+        questions = [DynamicTextQuestion.objects.create(
+            question_text='Why?', parent_object=f) for f in forms]
+        for f, q, force_new_set in ((forms[0], questions[0], False),
+                (forms[0], questions[0], False), (forms[1], questions[1], True),
+                (forms[1], questions[1], True)):
+            request = self.factory.post('/', {q.get_form_name(): 'Because'})
+            request.user = self.user
+            last = DynamicFormCreator(request, f.id,
+                force_new_set=force_new_set).response_set
+
+        with self.assertNumQueries(1):
+            latest = get_latest_response_sets(self.user, forms)
+        self.assertEqual([forms[0].pk, forms[1].pk], sorted(latest))
+        self.assertEqual(2, latest[forms[0].pk].submissions)
+        self.assertEqual(2, latest[forms[1].pk].submissions)
+        self.assertEqual(last.pk, latest[forms[1].pk].response_set_id)
+
+        self.assertEqual(2, rebuild_latest_response_sets())
+        latest = get_latest_response_sets(self.user, [f.pk for f in forms])
+        self.assertEqual(1, latest[forms[0].pk].submissions)
+        self.assertEqual(last.pk, latest[forms[1].pk].response_set_id)
+        self.assertEqual(last.added, latest[forms[1].pk].submitted)
+
+        last.delete()
+        self.assertEqual(None, LatestResponseSet.objects.get(
+            dynamic_form=forms[1]).response_set)
+
+    def test_published_versions(self):
+        df = DynamicForm.objects.create(name='Interview')
+        text = DynamicTextQuestion.objects.create(
+            question_text='Why?', parent_object=df)
+        mc = DynamicMultipleChoiceQuestion.objects.create(
+            question_text='Pick', parent_object=df)
+        red = DynamicMultipleChoiceAnswer.objects.create(question=mc,
+            answer_text='Red')
+        version = df.publish()
+        self.assertEqual(1, version.number)
+        self.assertEqual([u'Why?', u'Pick'],
+            [q['question_text'] for q in version.get_snapshot()])
+
+        # The draft changes, the published version doesn't.
+        text.question_text = 'Why not?'
+        text.save()
+        DynamicMultipleChoiceAnswer.objects.create(question=mc,
+            answer_text='Blue')
+        request = self.factory.get('/')
+        request.user = self.user
+        DynamicFormCreator(request, df.id)
+        # Only the form and its published version are read.
+        with self.assertNumQueries(1):
+            form = DynamicFormCreator(request, df.id).get()
+        self.assertEqual(u'Why?', form.fields[text.get_form_name()].label)
+        self.assertEqual(1, len(form.fields[mc.get_form_name()].choices))
+        self.assertEqual(form.render_cached(), form.render_cached())
+        form = DynamicFormCreator(request, df.id, draft=True).get()
+        self.assertEqual(u'Why not?', form.fields[text.get_form_name()].label)
+
+        request = self.factory.post('/', {text.get_form_name(): 'Because',
+            mc.get_form_name(): 'dynamic-multiple-choice-answer-%d' % red.pk})
+        request.user = self.user
+        response_set = DynamicFormCreator(request, df.id).response_set
+        self.assertEqual(version, response_set.form_version)
+
+        self.user.is_staff = self.user.is_superuser = True
+        self.user.save()
+        self.client.login(username='test', password='test')
+        response = self.client.post(
+            '/admin/dynamicforms/dynamicform/%d/publish/' % df.pk)
+        self.assertEqual(302, response.status_code)
+        version = DynamicForm.objects.get(pk=df.pk).published
+        self.assertEqual(2, version.number)
+        # Answers to the new version go to a new set; the old one keeps its
+        # version.
+        new_set = DynamicFormCreator(request, df.id).response_set
+        self.assertNotEqual(response_set, new_set)
+        self.assertEqual(version, new_set.form_version)
+        self.assertEqual(1, DynamicResponseSet.objects.get(
+            pk=response_set.pk).form_version.number)
+        self.assertEqual(new_set, DynamicFormCreator(request,
+            df.id).response_set)
+
+    def test_dropped_answers(self):
+        from signals import answers_dropped
+        df = DynamicForm.objects.create(name='Interview')
+        text = DynamicTextQuestion.objects.create(
+            question_text='Why?', parent_object=df)
+        mc = DynamicMultipleChoiceQuestion.objects.create(
+            question_text='Pick', parent_object=df)
+        red, blue = [DynamicMultipleChoiceAnswer.objects.create(question=mc,
+            answer_text=t) for t in ('Red', 'Blue')]
+        version = df.publish()
+        picked = ['dynamic-multiple-choice-answer-%d' % a.pk
+            for a in (red, blue)]
+        text_name = text.get_form_name()
+        blue.delete()
+        text.delete()
+        received = []
+
+        def receiver(sender, **kwargs):
+            received.append(kwargs)
+        answers_dropped.connect(receiver)
+        try:
+            request = self.factory.post('/', {text_name: 'Because',
+                mc.get_form_name(): picked})
+            request.user = self.user
+            creator = DynamicFormCreator(request, df.id)
+        finally:
+            answers_dropped.disconnect(receiver)
+        self.assertTrue(creator.is_success())
+        self.assertEqual(1, len(creator.response_set.responses))
+        expected = {text_name: u'Because', mc.get_form_name(): picked}
+        self.assertEqual(expected, creator.dropped)
+        self.assertEqual([(df.pk, version.pk, creator.response_set.pk,
+            expected)], [(r['dynamicform_id'], r['form_version_id'],
+                r['response_set_id'], r['values']) for r in received])
+
+    def test_clone(self):
+        import benchmark
+        for n in (1, 3):
+            df, data = benchmark.create_form(counts=dict.fromkeys(
+                benchmark.DEFAULT_COUNTS, n), choices=n + 1)
+            # Reading the questions and choices (one query per type and per
+            # choice model), creating the form, inserting the questions and
+            # reading back their ids, one insert per question type and per
+            # choice model.
+            with self.assertNumQueries(16):
+                copy = df.clone('Copy')
+            self.assertEqual('Copy', copy.name)
+            original, copied = df.get_questions(), copy.get_questions()
+            self.assertEqual(4 * n, len(copied))
+
+            def describe(q):
+                answers = None
+                if getattr(q, 'choice_class', None) is not None:
+                    answers = [a.answer_text for a in q.get_answers()]
+                return type(q), q.question_text, q.order, answers
+            self.assertEqual(map(describe, original), map(describe, copied))
+            self.assertFalse(set([q.pk for q in original]) &
+                set([q.pk for q in copied]))
+
+        self.user.is_staff = self.user.is_superuser = True
+        self.user.save()
+        self.client.login(username='test', password='test')
+        response = self.client.post(df.admin_url('copy'))
+        self.assertEqual(302, response.status_code)
+        copy = DynamicForm.objects.get(name='Copy of %s' % df.name)
+        self.assertEqual(4 * n, copy.questions.count())
+
+    def test_paged_forms(self):
+        df = DynamicForm.objects.create(name='Long')
+        first = DynamicTextQuestion.objects.create(question_text='One',
+            parent_object=df, order=1)
+        DynamicPageBreak.objects.create(question_text='Next', parent_object=df,
+            order=2)
+        second = DynamicTextQuestion.objects.create(question_text='Two',
+            parent_object=df, order=3)
+        third = DynamicYesNoQuestion.objects.create(question_text='Three',
+            parent_object=df, order=4)
+        request = self.factory.get('/')
+        request.user = self.user
+
+        # Without paging the break is left out.
+        form = DynamicFormCreator(request, df.id).get()
+        self.assertEqual(3, len(form.fields))
+        creator = DynamicFormCreator(request, df.id, page=2)
+        self.assertEqual(2, creator.page_count)
+        self.assertEqual([second.get_form_name(), third.get_form_name()],
+            creator.get().fields.keys())
+        creator = DynamicFormCreator(request, df.id, page=2, page_size=1)
+        self.assertEqual(3, creator.page_count)
+        self.assertEqual([second.get_form_name()],
+            creator.get().fields.keys())
+        self.assertRaises(Http404, DynamicFormCreator, request, df.id, page=3)
+
+        # Only the fields of the page are validated, and later pages add
+        # their answers to the set started by the first one in the session.
+        other = User.objects.create_user('other', 'other@test.com', 'other')
+        sessions = {self.user: {}, other: {}}
+
+        def post(interviewer, page, data, **kwds):
+            request = self.factory.post('/', data)
+            request.user = interviewer
+            request.session = sessions[interviewer]
+            return DynamicFormCreator(request, df.id, page=page,
+                user=self.user, **kwds)
+
+        creator = post(self.user, 1, {first.get_form_name(): 'a'},
+            force_new_set=True)
+        self.assertTrue(creator.is_success())
+        self.assertFalse(creator.is_finished())
+        self.assertEqual(2, creator.next_page)
+        started = creator.response_set
+        # Another interviewer runs the same user's form meanwhile.
+        post(other, 1, {first.get_form_name(): 'c'}, force_new_set=True)
+        creator = post(self.user, 2, {second.get_form_name(): 'b',
+            third.get_form_name(): 'yes'}, force_new_set=True)
+        self.assertTrue(creator.is_finished())
+        self.assertEqual(started, creator.response_set)
+        self.assertEqual(3, len(started.responses))
+        self.assertEqual({}, sessions[self.user])
+        self.assertEqual(2, LatestResponseSet.objects.get(
+            dynamic_form=df).submissions)
+
+        # Skipping to a later page doesn't reuse a finished set.
+        creator = post(self.user, 2, {second.get_form_name(): 'd',
+            third.get_form_name(): 'no'}, force_new_set=True)
+        self.assertNotEqual(started, creator.response_set)
+        self.assertEqual(2, len(creator.response_set.responses))
+
+        # Published versions keep their page breaks.
+        df.publish()
+        request = self.factory.get('/')
+        request.user = self.user
+        form = DynamicFormCreator(request, df.id, page=2).get()
+        self.assertEqual(2, len(form.fields))
+        self.assertEqual(form.render_cached(), form.render_cached())
+
+    def test_paged_form_queries(self):
+        schema_cache, forms.SCHEMA_CACHE = forms.SCHEMA_CACHE, False
+        try:
+            df = DynamicForm.objects.create(name='Long')
+            DynamicPageBreak.objects.create(question_text='Next',
+                parent_object=df, order=100)
+            last = DynamicYesNoQuestion.objects.create(question_text='Last',
+                parent_object=df, order=101)
+            request = self.factory.get('/')
+            request.user = self.user
+
+            # Page 2 costs the same however many questions page 1 has: the
+            # pages are cut from the ids and types of the questions, and
+            # only the questions of page 2 are resolved.
+            for order in range(50):
+                DynamicTextQuestion.objects.create(question_text='Q%d' % order,
+                    parent_object=df, order=order)
+                if order not in (0, 49):
+                    continue
+                with self.assertNumQueries(4) as context:
+                    creator = DynamicFormCreator(request, df.id, page=2,
+                        draft=True)
+                table = DynamicTextQuestion._meta.db_table
+                self.assertFalse([q for q in connection.queries[
+                    context.starting_queries:] if table in q['sql']])
+                self.assertEqual([last.get_form_name()],
+                    creator.form.fields.keys())
+                self.assertEqual([last], creator._get_questions())
+        finally:
+            forms.SCHEMA_CACHE = schema_cache
+
+    def test_form_schema_json(self):
+        import json
+        df = DynamicForm.objects.create(name='Remote')
+        text = DynamicTextQuestion.objects.create(question_text='Why?',
+            parent_object=df)
+        url = '/dynamicforms/%d/schema.json' % df.pk
+        response = self.client.get(url)
+        self.assertEqual(200, response.status_code)
+        etag = response['ETag']
+        questions = json.loads(response.content)['questions']
+        self.assertEqual([(text.pk, 'dynamictextquestion', 'Why?')],
+            [(q['id'], q['type'], q['question_text']) for q in questions])
+        self.assertEqual({'key': text.get_form_name(), 'label': 'Why?',
+            'choices': None,
+            'options': {'attrs': {'cols': '40', 'rows': '10'}}},
+            questions[0]['field'])
+        self.assertFalse('django.' in response.content)
+
+        # Only the form is read to answer a conditional request.
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(etag, response['ETag'])
+        # The tag comes from the database, so a worker with an empty cache
+        # agrees on it.
+        from django.core.cache import cache
+        cache.clear()
+        self.assertEqual('"%d-%d"' % (df.pk, DynamicForm.objects.get(
+            pk=df.pk).schema_version), etag)
+        self.assertEqual(304, self.client.get(url,
+            HTTP_IF_NONE_MATCH=etag).status_code)
+
+        text.question_text = 'Why not?'
+        text.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, response.status_code)
+        self.assertNotEqual(etag, response['ETag'])
+        version = df.publish()
+        response = self.client.get(url)
+        self.assertEqual('"%d-v%s"' % (df.pk, version.cache_key),
+            response['ETag'])
+        self.assertEqual(405, self.client.post(url).status_code)
+
+class SchemaTests(BaseTestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('test', 'test@test.com', 'test')
+        self.factory = RequestFactory()
+        self.df = DynamicForm.objects.create(name='Interview')
+        DynamicTextQuestion.objects.create(
+            question_text='What time is it?', parent_object=self.df)
+        self.mc = DynamicMultipleChoiceQuestion.objects.create(
+            question_text='Pick some', parent_object=self.df)
+        self.answer = DynamicMultipleChoiceAnswer.objects.create(
+            question=self.mc, answer_text='Red')
+        self.df = DynamicForm.objects.get(pk=self.df.pk)
+        self.schema_cache = forms.SCHEMA_CACHE
+        forms.SCHEMA_CACHE = True
+
+    def tearDown(self):
+        forms.SCHEMA_CACHE = self.schema_cache
+
+    def reload(self):
+        return DynamicForm.objects.get(pk=self.df.pk)
+
+    def test_cached_schema(self):
+        form_schema = schema.get_schema(self.df)
+        self.assertEqual(2, len(form_schema))
+        self.assertEqual(form_schema, schema.get_schema(self.df))
+
+        with self.assertNumQueries(0):
+            form = DynamicFormShell.from_schema(schema.get_schema(self.df))
+        self.assertStringIn('What time is it?', str(form))
+        self.assertStringIn('Red', str(form))
+
+    def test_schema_invalidation(self):
+        schema.get_schema(self.df)
+        self.answer.answer_text = 'Blue'
+        self.answer.save()
+        form = DynamicFormShell.from_schema(schema.get_schema(self.reload()))
+        self.assertStringIn('Blue', str(form))
+
+        self.mc.delete()
+        self.assertEqual(1, len(schema.get_schema(self.reload())))
+
+        # Only the saves of questions and choices bump the version.
+        version = self.reload().schema_version
+        User.objects.create_user('other', 'other@test.com', 'other')
+        self.assertEqual(version, self.reload().schema_version)
+        DynamicYesNoQuestion.objects.create(question_text='Sure?',
+            parent_object=self.df)
+        self.assertEqual(version + 1, self.reload().schema_version)
+
+    def test_field_options(self):
+        import json
+        from django import forms as django_forms
+        from django.core.validators import MinLengthValidator
+        field = django_forms.CharField(label='Code', required=False,
+            help_text='Two letters', max_length=2,
+            validators=[MinLengthValidator(2)],
+            widget=django_forms.TextInput(attrs={'size': 2}))
+        spec = schema.FieldSpec.from_field('code', field)
+        # The field instance doesn't take part in comparisons.
+        described = spec._replace(field=None)
+        self.assertEqual(described, spec)
+        self.assertEqual(hash(described), hash(spec))
+        built = spec.build()
+        self.assertFalse(built is field)
+        self.assertFalse(built.required)
+        self.assertRaises(django_forms.ValidationError, built.clean, 'a')
+
+        # Snapshots keep the options that can be serialised.
+        rebuilt = schema.FieldSpec.from_dict(
+            json.loads(json.dumps(spec.to_dict())))
+        self.assertEqual(spec, rebuilt)
+        built = rebuilt.build()
+        self.assertFalse(built.required)
+        self.assertEqual('Two letters', built.help_text)
+        self.assertEqual(2, built.max_length)
+        self.assertEqual(2, built.widget.attrs['size'])
+
+    def test_deleted_question(self):
+        from utils import bulk_delete
+        text = self.df.questions.all().resolve()[0]
+        request = self.factory.get('/')
+        request.user = self.user
+        DynamicFormCreator(request, self.df.id)
+        # Deleted by another process whose changes this cache missed.
+        bulk_delete(DynamicFormQuestion, [text.pk])
+        request = self.factory.post('/', {text.get_form_name(): 'Noon',
+            self.mc.get_form_name(): ['dynamic-multiple-choice-answer-%d' %
+                self.answer.pk]})
+        request.user = self.user
+        creator = DynamicFormCreator(request, self.df.id)
+        self.assertTrue(creator.is_success())
+        self.assertEqual(1, len(creator.response_set.responses))
+
+    def test_cached_html(self):
+        request = self.factory.get('/')
+        request.user = self.user
+        form = DynamicFormCreator(request, self.df.id).get()
+        html = form.render_cached('as_p')
+        self.assertStringIn('Red', html)
+        # Served from the cache: changing the field has no effect.
+        form.fields.values()[0].label = 'Changed'
+        self.assertEqual(html, form.render_cached('as_p'))
+        self.assertNotEqual(html, form.render_cached('as_table'))
+
+        self.answer.answer_text = 'Blue'
+        self.answer.save()
+        form = DynamicFormCreator(request, self.df.id).get()
+        self.assertStringIn('Blue', form.render_cached('as_p'))
+
+        bound = DynamicFormShell.from_schema(schema.get_schema(self.df),
+            {}, schema_version=form.schema_version)
+        self.assertStringIn('errorlist', bound.render_cached('as_p'), 2)
+
+    def test_file_based_cache(self):
+        import shutil
+        import tempfile
+        from django.core.cache import get_cache
+        location = tempfile.mkdtemp()
+        old_cache = schema.cache
+        schema.cache = get_cache(
+            'django.core.cache.backends.filebased.FileBasedCache',
+            LOCATION=location)
+        try:
+            form_schema = schema.get_schema(self.df)
+            # A fresh backend instance behaves like another process.
+            schema.cache = get_cache(
+                'django.core.cache.backends.filebased.FileBasedCache',
+                LOCATION=location)
+            with self.assertNumQueries(0):
+                self.assertEqual(form_schema, schema.get_schema(self.df))
+        finally:
+            schema.cache = old_cache
+            shutil.rmtree(location)
+
+
+class IndexTests(TransactionTestCase):
+    # SQLite commits before running EXPLAIN, hence TransactionTestCase.
+
+    def test_composite_indexes(self):
+        import indexes
+        if connection.vendor != 'sqlite':
+            return
+        self.assertEqual([], indexes.get_missing_indexes())
+        user = User.objects.create_user('test', 'test@test.com', 'test')
+        df = DynamicForm.objects.create(name='Interview')
+        q = DynamicTextQuestion.objects.create(
+            question_text='Why?', parent_object=df)
+        rs = DynamicResponseSet.objects.create(user=user,
+            dynamic_form=df, interviewer=user)
+
+        def plan(queryset):
+            sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+            cursor = connection.cursor()
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return ' '.join([row[-1] for row in cursor.fetchall()])
+
+        for queryset, model, name in (
+                (df.questions.all(), DynamicFormQuestion, 'parent'),
+                (DynamicResponseSet.objects.filter(user=user,
+                    dynamic_form=df, interviewer=user),
+                    DynamicResponseSet, 'owner'),
+                (DynamicTextResponse.objects.filter(dynamic_response_set=rs,
+                    question=q), DynamicTextResponse, 'set_question')):
+            index = indexes.get_index_name(connection, model, name)
+            self.assertTrue(index in plan(queryset), plan(queryset))
+
+
+class ConcurrencyTests(TransactionTestCase):
+    # Each thread has a connection of its own, so the database must be one
+    # they share, and see each other's commits in.
+
+    @unittest.skipIf(connection.vendor == 'sqlite' and
+        connection.settings_dict['TEST_NAME'] in (None, '', ':memory:'),
+        "Threads don't share an in-memory SQLite database.")
+    def test_concurrent_submissions(self):
+        self._submit_concurrently()
+
+    @unittest.skipIf(connection.vendor == 'sqlite' and
+        connection.settings_dict['TEST_NAME'] in (None, '', ':memory:'),
+        "Threads don't share an in-memory SQLite database.")
+    def test_concurrent_document_submissions(self):
+        old_storage = models.RESPONSE_STORAGE
+        models.RESPONSE_STORAGE = 'document'
+        try:
+            self._submit_concurrently()
+        finally:
+            models.RESPONSE_STORAGE = old_storage
+
+    def _submit_concurrently(self):
+        import threading
+        user = User.objects.create_user('test', 'test@test.com', 'test')
+        df = DynamicForm.objects.create(name='Interview')
+        q = DynamicTextQuestion.objects.create(
+            question_text='Why?', parent_object=df)
+        mc = DynamicMultipleChoiceQuestion.objects.create(
+            question_text='Pick', parent_object=df)
+        red = DynamicMultipleChoiceAnswer.objects.create(question=mc,
+            answer_text='Red')
+        red_key = 'dynamic-multiple-choice-answer-%d' % red.pk
+        threads, submissions = 8, 10
+        start = threading.Event()
+        errors = []
+
+        def submit():
+            factory = RequestFactory()
+            try:
+                start.wait()
+                for i in range(submissions):
+                    request = factory.post('/', {q.get_form_name(): 'Because',
+                        mc.get_form_name(): red_key})
+                    request.user = user
+                    if not DynamicFormCreator(request, df.id).is_success():
+                        errors.append('invalid')
+            except Exception, e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=submit) for i in range(threads)]
+        for worker in workers:
+            worker.start()
+        start.set()
+        for worker in workers:
+            worker.join()
+        self.assertEqual([], errors)
+        response_set = DynamicResponseSet.objects.get()
+        self.assertEqual(threads * submissions * 2,
+            len(response_set.responses))
+        self.assertEqual({red_key: threads * submissions},
+            df.get_tallies()[mc.pk])
+        self.assertEqual(threads * submissions,
+            LatestResponseSet.objects.get(user=user).submissions)
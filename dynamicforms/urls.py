@@ -0,0 +1,7 @@
+from django.conf.urls.defaults import *
+
+
+urlpatterns = patterns('dynamicforms.views',
+    url(r'^(?P<dynamicform_id>[0-9]+)/schema\.json$', 'form_schema',
+        name='dynamicforms_form_schema'),
+)
@@ -1,3 +1,19 @@
+import django.http
+from django.db import connections, router, transaction, IntegrityError
+from django.db.models import AutoField
+from django.db.models.deletion import CASCADE, SET_NULL
+
+
+# ``transaction.atomic`` on Django 1.6 and later, ``commit_on_success`` before.
+atomic = getattr(transaction, 'atomic', transaction.commit_on_success)
+
+# Django 1.5 and later have a dedicated response class for iterators; before
+# that, ``HttpResponse`` streams them as long as no middleware reads the
+# content.
+StreamingHttpResponse = getattr(django.http, 'StreamingHttpResponse',
+        django.http.HttpResponse)
+
+
 def get_class(class_string, exception=Exception):
     """
     Convert a string version of a function name to the callable object.
@@ -25,3 +41,171 @@ def get_mod_func(callback):
     except ValueError:
         return callback, ''
     return callback[:dot], callback[dot + 1:]
+
+
+def bulk_create(model, objs, using=None):
+    """
+    Insert ``objs``, a list of unsaved ``model`` instances, with a single
+    statement. Primary keys are not set on the instances.
+
+    Uses ``bulk_create`` where Django provides it and falls back to an
+    ``executemany`` INSERT otherwise. Only models without multi-table
+    inheritance are supported.
+    """
+    if not objs:
+        return
+    using = using or router.db_for_write(model)
+    manager = model._default_manager.db_manager(using)
+    if hasattr(manager, 'bulk_create'):
+        manager.bulk_create(objs)
+        return
+    insert_local_fields(model, objs, using)
+
+
+def insert_local_fields(model, objs, using=None):
+    """
+    Insert the values of the fields ``model`` itself declares for every
+    instance of ``objs`` with an ``executemany`` INSERT. Automatic primary
+    keys are left to the database.
+
+    With multi-table inheritance, calling it for each model of the chain
+    with the same instances, parents first, saves them in bulk as long as
+    the parent links are set.
+    """
+    if not objs:
+        return
+    using = using or router.db_for_write(model)
+    connection = connections[using]
+    fields = [f for f in model._meta.local_fields
+            if not isinstance(f, AutoField)]
+    qn = connection.ops.quote_name
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (qn(model._meta.db_table),
+            ', '.join([qn(f.column) for f in fields]),
+            ', '.join(['%s'] * len(fields)))
+    params = [[f.get_db_prep_save(f.pre_save(obj, True), connection=connection)
+            for f in fields] for obj in objs]
+    connection.cursor().executemany(sql, params)
+    if transaction.is_managed(using):
+        transaction.set_dirty(using)
+    else:
+        transaction.commit_unless_managed(using)
+
+
+def supports_on_conflict(connection):
+    """
+    Tell whether the database accepts ``INSERT ... ON CONFLICT DO NOTHING``:
+    SQLite 3.24 and PostgreSQL 9.5 or later.
+    """
+    if connection.vendor == 'sqlite':
+        from django.db.backends.sqlite3.base import Database
+        return Database.sqlite_version_info >= (3, 24, 0)
+    if connection.vendor == 'postgresql':
+        connection.cursor()
+        return getattr(connection.connection, 'server_version', 0) >= 90500
+    return False
+
+
+def insert_unless_exists(obj, unique_fields, using=None):
+    """
+    Insert ``obj`` unless a row with the same values of ``unique_fields``, a
+    field name or a tuple of names covered by a unique constraint, already
+    exists, and return whether it was inserted. The primary key of an
+    inserted ``obj`` is set.
+
+    Uses ``INSERT ... ON CONFLICT DO NOTHING`` where supported, and
+    otherwise a plain INSERT inside a savepoint which is rolled back on an
+    ``IntegrityError``.
+    """
+    model = type(obj)
+    if isinstance(unique_fields, basestring):
+        unique_fields = (unique_fields,)
+    using = using or router.db_for_write(model)
+    connection = connections[using]
+    if not supports_on_conflict(connection):
+        sid = transaction.savepoint(using)
+        try:
+            obj.save(force_insert=True, using=using)
+        except IntegrityError:
+            transaction.savepoint_rollback(sid, using)
+            return False
+        transaction.savepoint_commit(sid, using)
+        return True
+
+    fields = [f for f in model._meta.local_fields
+            if not isinstance(f, AutoField)]
+    qn = connection.ops.quote_name
+    table = model._meta.db_table
+    sql = 'INSERT INTO %s (%s) VALUES (%s) ON CONFLICT (%s) DO NOTHING' % (
+            qn(table), ', '.join([qn(f.column) for f in fields]),
+            ', '.join(['%s'] * len(fields)),
+            ', '.join([qn(model._meta.get_field(f).column)
+                for f in unique_fields]))
+    params = [f.get_db_prep_save(f.pre_save(obj, True), connection=connection)
+            for f in fields]
+    cursor = connection.cursor()
+    cursor.execute(sql, params)
+    inserted = cursor.rowcount == 1
+    if inserted:
+        obj.pk = connection.ops.last_insert_id(cursor, table,
+                model._meta.pk.column)
+    if transaction.is_managed(using):
+        transaction.set_dirty(using)
+    else:
+        transaction.commit_unless_managed(using)
+    return inserted
+
+
+def bulk_delete(model, pks, using=None):
+    """
+    Delete the ``model`` rows whose primary keys are in ``pks``, together with
+    every row that cascades from them, inside one transaction.
+
+    Instead of loading each object like ``QuerySet.delete()``, this issues a
+    single ``DELETE ... WHERE ... IN (subquery)`` per related table, children
+    first, or an ``UPDATE`` for ``SET_NULL`` relations. No signals are sent.
+    Other kinds of relations, self-references and many-to-many fields are
+    not supported and raise ``ValueError``.
+    """
+    pks = list(pks)
+    if not pks:
+        return
+    while model._meta.parents:
+        model = model._meta.parents.keys()[0]
+    using = using or router.db_for_write(model)
+    connection = connections[using]
+    with atomic(using=using):
+        _cascade_delete(connection, model, model._meta.pk.column,
+                ', '.join(['%s'] * len(pks)), pks)
+        if transaction.is_managed(using):
+            transaction.set_dirty(using)
+
+
+def _cascade_delete(connection, model, column, sql, params):
+    """
+    Delete the rows of ``model`` whose ``column`` is in the result of ``sql``,
+    after the rows that refer to them.
+    """
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    if model._meta.many_to_many:
+        raise ValueError("Can't bulk delete %s: it has many-to-many fields."
+                % model.__name__)
+    select = 'SELECT %s FROM %s WHERE %s IN (%s)' % (
+            qn(model._meta.pk.column), table, qn(column), sql)
+    for rel in model._meta.get_all_related_objects(local_only=True,
+            include_hidden=True):
+        on_delete = getattr(rel.field.rel, 'on_delete', CASCADE)
+        if on_delete is SET_NULL and rel.model is not model:
+            rel_column = qn(rel.field.column)
+            connection.cursor().execute(
+                    'UPDATE %s SET %s = NULL WHERE %s IN (%s)' % (
+                    qn(rel.model._meta.db_table), rel_column, rel_column,
+                    select), params)
+            continue
+        if rel.model is model or on_delete is not CASCADE:
+            raise ValueError("Can't bulk delete %s: %s.%s doesn't cascade." %
+                    (model.__name__, rel.model.__name__, rel.field.name))
+        _cascade_delete(connection, rel.model, rel.field.column, select,
+                params)
+    connection.cursor().execute('DELETE FROM %s WHERE %s IN (%s)' % (
+            table, qn(column), sql), params)
@@ -1,6 +1,11 @@
 from django.contrib.contenttypes.models import ContentType
-from django.http import HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseNotModified, \
+        HttpResponseRedirect
+from django.shortcuts import get_object_or_404
+from django.utils.http import parse_etags, quote_etag
+from django.views.decorators.http import require_GET
 import models
+import schema
 
 
 def add_dynamicform_to_request(old_view):
@@ -9,8 +14,8 @@ def add_dynamicform_to_request(old_view):
     so generic content types know their parent on creation.
     """
     def new_view(cls, request, *args, **kwds):
-        dynamicform_id = ContentType.objects.filter(app_label='dynamicforms',
-                model='dynamicform').get().id
+        dynamicform_id = ContentType.objects.get_for_model(
+                models.DynamicForm).id
         if (request.method == 'GET'
             and request.session.get('last_dynamicform_id', None)):
             import copy
@@ -44,3 +49,41 @@ def list_contents_match(l1, l2):
     l1.sort()
     l2.sort()
     return l1 == l2
+
+
+@require_GET
+def form_schema(request, dynamicform_id):
+    """
+    Serve the questions of a form, with their types, fields and choices, as
+    JSON for clients that render forms themselves. Like
+    ``DynamicFormCreator``, it describes the latest published version of the
+    form, or its current questions if it was never published.
+
+    The response carries a strong ETag naming that version, the published
+    version's key or the form's ``schema_version`` column, so every process
+    agrees on it. A matching ``If-None-Match`` is answered with 304 without
+    reading the questions.
+    """
+    dynamicform = get_object_or_404(
+            models.DynamicForm.objects.select_related('published'),
+            pk=dynamicform_id)
+    version = dynamicform.published
+    if version is not None:
+        content_version = 'v' + version.cache_key
+        get_snapshot = version.get_snapshot
+        timeout = schema.VERSION_CACHE_TIMEOUT
+    else:
+        content_version = str(dynamicform.schema_version)
+        get_snapshot = lambda: schema.take_snapshot(
+                dynamicform.get_questions())
+        timeout = schema.SCHEMA_CACHE_TIMEOUT
+    etag = '%d-%s' % (dynamicform.pk, content_version)
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH', '')
+    if if_none_match.strip() == '*' or etag in parse_etags(if_none_match):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(schema.get_json(dynamicform.pk,
+                content_version, get_snapshot, timeout),
+                content_type='application/json')
+    response['ETag'] = quote_etag(etag)
+    return response
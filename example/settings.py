@@ -17,6 +17,9 @@ DATABASES = {
         'PASSWORD': '',                  # Not used with sqlite3.
         'HOST': '',                      # Set to empty string for localhost. Not used with sqlite3.
         'PORT': '',                      # Set to empty string for default. Not used with sqlite3.
+        # A file rather than memory, so that the concurrency tests' threads
+        # share the test database.
+        'TEST_NAME': 'test.db',
     }
 }
 
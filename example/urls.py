@@ -6,6 +6,7 @@ admin.autodiscover()
 
 urlpatterns = patterns('',
     url(r'^admin/', include(admin.site.urls)),
+    url(r'^dynamicforms/', include('dynamicforms.urls')),
     url(r'^$', 'survey.views.home'),
     url(r'^poll/(?P<poll_id>[0-9]+)$', 'survey.views.poll', name='poll'),
 )